@@ -75,6 +75,12 @@ parser.add_argument(
     help=f"Set configuration path (default is {config_path}'). If not found, it will be created and populated with a default config file.",
 )
 
+parser.add_argument(
+    "--rebuild-cache",
+    action="store_true",
+    help="Render every article in every wiki, store the results in the render cache, and exit.",
+)
+
 args = parser.parse_args()
 config_path = args.config_path or config_path
 
@@ -103,7 +109,30 @@ if __name__ == "__main__":
 
         models.create_db()
 
+    import migrations
+
+    try:
+        migrations.run()
+    except migrations.MigrationError as e:
+        print(f"Could not update the database: {e}")
+        sys.exit(1)
+
+    if args.rebuild_cache:
+        import models
+
+        for wiki in models.Wiki.select():
+            count = wiki.rebuild_render_cache()
+            print(f'Rendered {count} articles in wiki "{wiki.title}"')
+        sys.exit(0)
+
     import routes
+    import jobs
+
+    # Picks up any jobs left queued when the server last stopped
+    jobs.start()
+
+    # Compresses the static files once, rather than on every request
+    routes.Wiki.static_assets.precompress()
 
     img_paths = getattr(config, "IMG_PATHS", None)
     if img_paths:
@@ -128,14 +157,11 @@ if __name__ == "__main__":
         f'{settings.PRODUCT} running on port {port}\nNavigate to "/quit" in browser to shut down'
     )
 
-    from wsgiref.simple_server import make_server, WSGIServer
-    from socketserver import ThreadingMixIn
-
-    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
-        pass
+    from wsgi_server import make_server
+    from compression import GzipMiddleware
 
     import utils
 
-    with make_server("0.0.0.0", port, routes.app, ThreadingWSGIServer) as httpd:
+    with make_server("0.0.0.0", port, GzipMiddleware(routes.app)) as httpd:
         utils.server = httpd
         httpd.serve_forever()
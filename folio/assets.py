@@ -0,0 +1,88 @@
+from hashlib import blake2b
+from pathlib import Path
+import gzip
+import mimetypes
+import os
+import shutil
+import threading
+
+# Types worth compressing; images and web fonts other than these are already
+COMPRESSIBLE = {".css", ".js", ".map", ".svg", ".eot", ".otf", ".ttf"}
+
+
+class StaticAssets:
+    """
+    The static files, served under a URL with a fingerprint of their
+    contents, so that browsers can keep them for as long as they like.
+    Any change to the files changes the URL.
+
+    Files worth compressing can be gzipped ahead of time, into `cache_path`,
+    to be served as they are to clients that accept gzip.
+    """
+
+    def __init__(self, path: Path, cache_path: Path):
+        self.path = path
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self) -> str:
+        with self.lock:
+            if self._fingerprint is None:
+                digest = blake2b(digest_size=8)
+                for file in self.files():
+                    digest.update(file.name.encode("utf-8") + b"\0")
+                    digest.update(file.read_bytes())
+                self._fingerprint = digest.hexdigest()
+            return self._fingerprint
+
+    @property
+    def compressed_path(self) -> Path:
+        return Path(self.cache_path, self.fingerprint)
+
+    def files(self) -> list:
+        return sorted(_ for _ in self.path.iterdir() if _.is_file())
+
+    def precompress(self) -> int:
+        """
+        Gzip the files worth compressing, unless that was done already for
+        this fingerprint, and remove the ones for earlier fingerprints.
+        Returns the number of compressed files.
+        """
+        compressed_path = self.compressed_path
+        if not compressed_path.exists():
+            # Written aside and renamed into place, so it is never seen half-done
+            partial_path = Path(self.cache_path, f"{self.fingerprint}.{os.getpid()}")
+            partial_path.mkdir(parents=True, exist_ok=True)
+            for file in self.files():
+                if file.suffix not in COMPRESSIBLE:
+                    continue
+                data = file.read_bytes()
+                compressed = gzip.compress(data, 9, mtime=0)
+                if len(compressed) < len(data):
+                    Path(partial_path, f"{file.name}.gz").write_bytes(compressed)
+            try:
+                partial_path.rename(compressed_path)
+            except OSError:
+                # Another process got there first
+                shutil.rmtree(partial_path, ignore_errors=True)
+
+        for path in self.cache_path.iterdir():
+            if path.name != self.fingerprint and path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+
+        return len(list(compressed_path.iterdir()))
+
+    def compressed(self, filename: str):
+        """
+        The path of the gzipped copy of `filename`, if there is one.
+        """
+        if "/" in filename or filename.startswith("."):
+            return None
+        path = Path(self.compressed_path, f"{filename}.gz")
+        return path if path.is_file() else None
+
+    @staticmethod
+    def mimetype(filename: str) -> str:
+        return mimetypes.guess_type(filename)[0] or "application/octet-stream"
@@ -0,0 +1,210 @@
+from collections import OrderedDict
+import sys
+import threading
+
+
+def size_of(value) -> int:
+    """
+    Approximate memory used by a cached value, in bytes.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(size_of(item) for item in value)
+    return size
+
+
+class RenderCache:
+    """
+    Cache for rendered output, shared by every request thread.
+
+    Each entry records the dependencies it was rendered from, so that a change
+    evicts only the entries that actually depend on it.
+
+    Dependencies are tuples whose first item is the scope they belong to,
+    such as the id of a wiki. Every invalidation bumps the generation of the
+    scopes it touches, so a render that started before the invalidation
+    can tell that it may be stale, and is not stored.
+
+    Once the entries take up more than `max_size` bytes, the least recently
+    used ones are evicted.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.dependents: dict = {}
+        self.generations: dict = {}
+        self.epoch = 0
+        # Keys being rendered, with an event set when the render finishes
+        self.rendering: dict = {}
+        # Generations as of when each thread pinned its stamps, if it did
+        self.pinned = threading.local()
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entry(key)
+        return default if entry is None else entry[0]
+
+    def entry(self, key):
+        """
+        The value cached under `key` and the dependencies it was cached with,
+        or None if nothing is.
+        """
+        with self.lock:
+            try:
+                value, dependencies, _ = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value, dependencies
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def dependencies(self, key) -> frozenset:
+        with self.lock:
+            try:
+                return self.entries[key][1]
+            except KeyError:
+                return frozenset()
+
+    def stamp(self, scope) -> tuple:
+        """
+        Generation of `scope`, to be taken before rendering anything in it.
+        If this thread has pinned its stamps, the generation as of then.
+        """
+        pinned = getattr(self.pinned, "generations", None)
+        if pinned is None:
+            return self.current_stamp(scope)
+        epoch, generations = pinned
+        return scope, epoch, generations.get(scope, 0)
+
+    def current_stamp(self, scope) -> tuple:
+        with self.lock:
+            return scope, self.epoch, self.generations.get(scope, 0)
+
+    def is_current(self, stamp) -> bool:
+        """
+        Whether nothing in the stamp's scope has been invalidated since it was taken.
+        """
+        return stamp == self.current_stamp(stamp[0])
+
+    def pin(self):
+        """
+        Have this thread's stamps taken now, until `unpin()`.
+        For a request that renders from a snapshot of the database taken
+        after this, where a stamp taken later could postdate an invalidation
+        the snapshot doesn't reflect.
+        """
+        with self.lock:
+            self.pinned.generations = (self.epoch, dict(self.generations))
+
+    def unpin(self):
+        self.pinned.generations = None
+
+    def set(self, key, value, dependencies=(), stamp=None) -> bool:
+        """
+        Cache `value` under `key`, unless `stamp` is no longer current.
+        Returns whether the value was cached.
+        """
+        dependencies = frozenset(dependencies)
+        size = size_of(value)
+        with self.lock:
+            if stamp is not None and not self.is_current(stamp):
+                return False
+            self.discard(key)
+            if self.max_size is not None and size > self.max_size:
+                return False
+            self.entries[key] = (value, dependencies, size)
+            self.size += size
+            for dependency in dependencies:
+                self.dependents.setdefault(dependency, set()).add(key)
+            if self.max_size is not None:
+                while self.size > self.max_size:
+                    self.discard(next(iter(self.entries)))
+                    self.evictions += 1
+        return True
+
+    def get_or_render(self, key, render, dependencies=False):
+        """
+        The value cached under `key`, or else the result of `render()`,
+        which is expected to cache it. Concurrent misses for the same key
+        wait for one call to `render()` instead of each making their own.
+
+        With `dependencies`, the value comes with the dependencies it was
+        cached with, as an entry does, and `render()` returns both too.
+        """
+        while True:
+            with self.lock:
+                entry = self.entry(key)
+                if entry is not None:
+                    return entry if dependencies else entry[0]
+                pending = self.rendering.get(key)
+                if pending is None:
+                    done = self.rendering[key] = threading.Event()
+            if pending is None:
+                break
+            # If that render couldn't be cached, the next waiter renders again
+            pending.wait()
+
+        try:
+            return render()
+        finally:
+            with self.lock:
+                del self.rendering[key]
+            done.set()
+
+    def discard(self, key):
+        with self.lock:
+            try:
+                _, dependencies, size = self.entries.pop(key)
+            except KeyError:
+                return
+            self.size -= size
+            for dependency in dependencies:
+                keys = self.dependents.get(dependency)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[dependency]
+
+    def invalidate(self, *dependencies):
+        """
+        Evict every entry that depends on any of `dependencies`.
+        """
+        with self.lock:
+            for dependency in dependencies:
+                scope = dependency[0]
+                self.generations[scope] = self.generations.get(scope, 0) + 1
+                for key in self.dependents.pop(dependency, ()):
+                    self.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dependents.clear()
+            self.size = 0
+            self.generations.clear()
+            self.epoch += 1
@@ -0,0 +1,134 @@
+from hashlib import blake2b
+import gzip
+
+from data import config
+
+from cache import RenderCache
+
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_SIZE = getattr(config, "COMPRESS_MIN_SIZE", 1024)
+
+COMPRESS_LEVEL = getattr(config, "COMPRESS_LEVEL", 6)
+
+# Memory kept for compressed copies of responses
+COMPRESS_CACHE_SIZE = getattr(config, "COMPRESS_CACHE_SIZE", 16 * 1024**2)
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+def accepts_gzip(environ) -> bool:
+    """
+    Whether the request's Accept-Encoding header allows a gzipped response.
+    """
+    for coding in environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, parameters = coding.partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            quality = parameters.replace(" ", "").removeprefix("q=")
+            try:
+                return float(quality or 1) > 0
+            except ValueError:
+                return True
+    return False
+
+
+class GzipMiddleware:
+    """
+    WSGI middleware that gzips responses for clients that accept it,
+    when they are large enough to be worth it.
+
+    Compressed copies are cached by the contents they were made from, so a
+    page served from the render caches is compressed once, not on every hit.
+    """
+
+    def __init__(
+        self, app, minimum_size=COMPRESS_MIN_SIZE, cache_size=COMPRESS_CACHE_SIZE
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = RenderCache(cache_size)
+
+    def __call__(self, environ, start_response):
+        response = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return written.append
+
+        body = self.app(environ, capture)
+        status, headers, exc_info = response
+        if not self.compressible(status, headers, body):
+            start_response(status, headers, exc_info)
+            return written + list(body) if written else body
+
+        # Sent whether or not this response is compressed, as it could have been
+        headers = self.vary_headers(headers)
+        if environ.get("REQUEST_METHOD") == "HEAD" or not accepts_gzip(environ):
+            start_response(status, headers, exc_info)
+            return written + body
+
+        data = b"".join(written + body)
+        if len(data) < self.minimum_size:
+            start_response(status, headers, exc_info)
+            return [data]
+
+        compressed = self.compress(data)
+        start_response(status, self.compressed_headers(headers, compressed), exc_info)
+        return [compressed]
+
+    def compress(self, data: bytes) -> bytes:
+        key = blake2b(data, digest_size=16).digest()
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = gzip.compress(data, COMPRESS_LEVEL, mtime=0)
+            self.cache.set(key, compressed)
+        return compressed
+
+    @staticmethod
+    def compressible(status: str, headers: list, body) -> bool:
+        # Files are streamed, and not held in memory to be compressed
+        if not status.startswith("200") or not isinstance(body, list):
+            return False
+        content_type = ""
+        for name, value in headers:
+            name = name.lower()
+            if name == "content-encoding":
+                return False
+            if name == "content-type":
+                content_type = value
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    @staticmethod
+    def vary_headers(headers: list) -> list:
+        """
+        `headers`, with Accept-Encoding added to the fields the response varies by.
+        """
+        vary = [value for name, value in headers if name.lower() == "vary"]
+        fields = {_.strip().lower() for value in vary for _ in value.split(",")}
+        if fields & {"accept-encoding", "*"}:
+            return headers
+        headers = [(name, value) for name, value in headers if name.lower() != "vary"]
+        headers.append(("Vary", ", ".join(vary + ["Accept-Encoding"])))
+        return headers
+
+    @staticmethod
+    def compressed_headers(headers: list, body: bytes) -> list:
+        compressed = [
+            ("Content-Encoding", "gzip"),
+            ("Content-Length", str(len(body))),
+        ]
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered == "content-length":
+                continue
+            if lowered == "etag" and not value.startswith("W/"):
+                # The compressed body isn't byte-for-byte the one tagged,
+                # but is equivalent to it, so If-None-Match still matches
+                value = f"W/{value}"
+            compressed.append((name, value))
+        return compressed
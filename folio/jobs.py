@@ -0,0 +1,164 @@
+from queue import Queue
+import datetime
+import json
+import threading
+import traceback
+
+from data import config
+
+from models import Job
+
+# Number of jobs that can run at the same time
+JOB_WORKERS = getattr(config, "JOB_WORKERS", 2)
+
+# Functions that carry out each kind of job
+handlers: dict = {}
+
+# Jobs being carried out, by id. These are the instances their workers use,
+# so progress and cancellation are seen without going through the database.
+running: dict = {}
+
+_queue: Queue = Queue()
+_workers: list = []
+_lock = threading.Lock()
+
+
+def handler(kind: str):
+    """
+    Register the decorated function to carry out jobs of `kind`.
+    It is called with the job, its wiki, and the job's arguments.
+    """
+
+    def register(function):
+        handlers[kind] = function
+        return function
+
+    return register
+
+
+def start():
+    """
+    Start the worker threads, unless they are running already, and pick up
+    the jobs left queued when the server last stopped.
+    """
+    with _lock:
+        if _workers:
+            return
+        for _ in range(JOB_WORKERS):
+            worker = threading.Thread(target=_work, name=f"job-worker-{_}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+        # Nothing is running yet, so these were cut short by the last shutdown
+        Job.update(
+            status=Job.FAILED,
+            message="Interrupted by a restart.",
+            finished=datetime.datetime.now(),
+        ).where(Job.status == Job.RUNNING).execute()
+
+        for job in Job.select(Job.id).where(Job.status == Job.QUEUED).order_by(Job.id):
+            _queue.put(job.id)
+
+
+def enqueue(kind: str, title: str, wiki=None, **arguments) -> Job:
+    """
+    Queue a job of `kind` for `wiki`, to be carried out in the background.
+    `arguments` are passed on to its handler, and must be JSON-serializable.
+    """
+    start()
+    job = Job.create(
+        kind=kind,
+        title=title,
+        wiki_id=None if wiki is None else wiki.id,
+        arguments=json.dumps(arguments),
+    )
+    _queue.put(job.id)
+    return job
+
+
+def get(job_id: int) -> Job:
+    """
+    The job with `job_id`, as its worker sees it if it is running.
+    Raises Job.DoesNotExist.
+    """
+    job = running.get(job_id)
+    if job is not None:
+        return job
+    return Job.get_by_id(job_id)
+
+
+def cancel(job_id: int):
+    """
+    Ask a job to stop. A queued job is cancelled at once; a running one
+    stops the next time its handler checks, if it can be stopped at all.
+    """
+    job = running.get(job_id)
+    if job is None:
+        cancelled = (
+            Job.update(
+                status=Job.CANCELLED,
+                message="Cancelled.",
+                cancel_requested=True,
+                finished=datetime.datetime.now(),
+            )
+            .where(Job.id == job_id, Job.status == Job.QUEUED)
+            .execute()
+        )
+        if cancelled:
+            return
+        # Started since it was looked for
+        job = running.get(job_id)
+    if job is not None:
+        job.cancel_requested = True
+
+
+def run(job: Job):
+    """
+    Carry out a queued `job` in this thread.
+    """
+    running[job.id] = job
+    try:
+        # Claimed here, in case it was cancelled while it waited
+        claimed = (
+            Job.update(status=Job.RUNNING)
+            .where(Job.id == job.id, Job.status == Job.QUEUED)
+            .execute()
+        )
+        if not claimed:
+            return
+        job.status = Job.RUNNING
+
+        try:
+            job.check()
+            wiki = job.wiki
+            if job.wiki_id is not None and wiki is None:
+                raise Exception("The wiki for this job no longer exists.")
+            handlers[job.kind](job, wiki, **json.loads(job.arguments))
+        except Job.Cancelled as e:
+            job.status = Job.CANCELLED
+            # Handlers that stop after committing some of their work say how much
+            job.message = str(e) or "Cancelled."
+        except Exception as e:
+            traceback.print_exc()
+            job.status = Job.FAILED
+            job.message = f"{e.__class__.__name__}: {e}"
+        else:
+            job.status = Job.DONE
+            if job.total is not None:
+                job.done = job.total
+
+        job.finished = datetime.datetime.now()
+        job.save()
+    finally:
+        del running[job.id]
+
+
+def _work():
+    while True:
+        job = Job.get_or_none(Job.id == _queue.get())
+        if job is None:
+            continue
+        try:
+            run(job)
+        except Exception:
+            traceback.print_exc()
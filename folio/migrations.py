@@ -0,0 +1,102 @@
+import json
+import time
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+from models import db, System, Job, Article, RenderDependency
+from settings import DB_SCHEMA
+
+# Functions that bring the database up to each schema version, by version
+migrations: dict = {}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration(version: int):
+    """
+    Register the decorated function to bring the database from `version - 1`
+    to `version`. It is called with a SqliteMigrator, inside a transaction.
+    Each migration must also be reflected in the models, which is how new
+    databases get the current schema.
+    """
+
+    def register(function):
+        if version in migrations:
+            raise MigrationError(f"Duplicate migration for schema {version}")
+        migrations[version] = function
+        return function
+
+    return register
+
+
+def schema_version() -> int:
+    """
+    The schema version stored in the database. Databases from before it
+    was stored at all are at version 0.
+    """
+    return int(System.get_metadata("schema", 0))
+
+
+def run(report=print) -> list:
+    """
+    Apply, in order, each migration the database hasn't had yet.
+    Each runs in a transaction of its own, so a failed migration leaves
+    the database at the version before it. Returns the versions applied,
+    with the time each took in seconds.
+    """
+    version = schema_version()
+    if version > DB_SCHEMA:
+        raise MigrationError(
+            f"The database has schema {version}, but this version of the "
+            f"program only knows up to {DB_SCHEMA}"
+        )
+
+    migrator = SqliteMigrator(db)
+    applied = []
+    for target in range(version + 1, DB_SCHEMA + 1):
+        function = migrations.get(target)
+        if function is None:
+            raise MigrationError(f"No migration to schema {target}")
+        start = time.perf_counter()
+        with db.atomic():
+            function(migrator)
+            System.set_metadata("schema", target)
+        elapsed = time.perf_counter() - start
+        applied.append((target, elapsed))
+        report(
+            f"Migrated database to schema {target} "
+            f"({(function.__doc__ or function.__name__).strip()}) in {elapsed:.2f}s"
+        )
+    return applied
+
+
+@migration(1)
+def add_jobs(migrator):
+    """Background jobs"""
+    # Servers before this migration created the table when they started
+    Job.create_table(safe=True)
+
+
+@migration(2)
+def add_lookup_indexes(migrator):
+    """Indexes for lookups by title, file and metadata key"""
+    migrate(
+        migrator.add_index("article", ("wiki_id", "title"), False),
+        migrator.add_index("metadata", ("item", "item_id", "key"), False),
+        migrator.add_index("tag", ("wiki_id", "title"), False),
+        migrator.add_index("media", ("wiki_id", "file_path"), False),
+    )
+
+
+@migration(3)
+def add_render_dependencies(migrator):
+    """What each persisted render depends on"""
+    RenderDependency.create_table()
+    renders = Article.select(Article.id, Article.rendered_content).where(
+        Article.rendered_content.is_null(False)
+    )
+    for article in renders.iterator():
+        _, dependencies, _ = article.rendered_content.split("\n", 2)
+        RenderDependency.record(article.id, json.loads(dependencies))
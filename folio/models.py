@@ -11,41 +11,161 @@ try:
     import regex as re
 except ImportError:
     import re  # type: ignore
+
+# Only the regex module can stop a match that runs too long
+REGEX_TIMEOUTS = re.__name__ == "regex"
 import datetime
 from data import config
 import os
+import json
 from hashlib import blake2b
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import threading
+import time
 
 from playhouse.sqlite_ext import SqliteExtDatabase, FTSModel, RowIDField, SearchField
-from peewee import SQL
+from peewee import SQL, fn, chunked
 
 import settings
 
 from pathlib import Path
 
-db = SqliteExtDatabase(
-    Path(config.DATA_PATH, "wiki.db"),
-    pragmas=(
-        ("cache_size", -1024 * 64),
-        ("journal_mode", "wal"),
-        ("synchronous", 0),
-        ("temp_store", "MEMORY"),
-    ),
+DB_PRAGMAS = (
+    ("cache_size", -1024 * 64),
+    ("journal_mode", "wal"),
+    ("synchronous", 0),
+    ("temp_store", "MEMORY"),
 )
 
+
+class Database(SqliteExtDatabase):
+    """
+    Counts the queries run by each thread, for render profiling,
+    keeps the reads of each request in one transaction,
+    and holds an identity map for each request.
+    """
+
+    # Statements that a read transaction can run
+    read_statements = ("SELECT", "WITH")
+
+    def __init__(self, *a, **ka):
+        super().__init__(*a, **ka)
+        self.counter = threading.local()
+        self.requests = threading.local()
+
+    @property
+    def query_count(self):
+        return getattr(self.counter, "queries", 0)
+
+    @property
+    def identities(self) -> Optional[dict]:
+        """
+        Model instances loaded during the current request, by (model, id),
+        or None outside a request.
+        """
+        return getattr(self.requests, "identities", None)
+
+    def execute_sql(self, sql, *a, **ka):
+        self.counter.queries = self.query_count + 1
+        read = sql.lstrip()[:6].upper().startswith(self.read_statements)
+        if not read:
+            if getattr(self.requests, "reads", None) is not None:
+                self.end_reads()
+            # Anything loaded so far may be changed by the write
+            if getattr(self.requests, "identities", None):
+                self.requests.identities.clear()
+        return super().execute_sql(sql, *a, **ka)
+
+    def atomic(self, *a, **ka):
+        # Anything done in a transaction of its own is likely to write
+        self.end_reads()
+        return super().atomic(*a, **ka)
+
+    def transaction(self, *a, **ka):
+        self.end_reads()
+        return super().transaction(*a, **ka)
+
+    def begin_request(self, read_only=False):
+        """
+        Open this thread's connection, if it isn't already, for a request.
+        The reads of a read-only request run in one deferred transaction,
+        so they all see the database as it was when the first one ran,
+        and renders made from them are stamped from before it.
+        """
+        self.connect(reuse_if_open=True)
+        self.requests.identities = {}
+        if read_only:
+            # Before the snapshot, which starts with the first read
+            Wiki.article_cache.pin()
+            reads = super().transaction("DEFERRED")
+            reads.__enter__()
+            self.requests.reads = reads
+
+    def end_reads(self):
+        """
+        End the request's read transaction, if any, before the request writes anything.
+        """
+        reads = getattr(self.requests, "reads", None)
+        if reads is None:
+            return
+        self.requests.reads = None
+        self._state.transactions.remove(reads)
+        self.commit()
+
+    def end_request(self):
+        self.end_reads()
+        self.requests.identities = None
+        Wiki.article_cache.unpin()
+
+
+db = Database(Path(config.DATA_PATH, "wiki.db"), pragmas=DB_PRAGMAS)
+
 db.connect()
 
+_inherited_connections = []
+
+
+def open_read_only():
+    """
+    Reopen the database read-only, for use by render worker processes.
+    """
+    # A connection inherited across fork() belongs to the parent,
+    # and closing it here could checkpoint the WAL from under it.
+    _inherited_connections.append(db._state.conn)
+    db._state.reset()
+    db.init(
+        Path(config.DATA_PATH, "wiki.db").resolve().as_uri() + "?mode=ro",
+        uri=True,
+        pragmas=DB_PRAGMAS[:1] + DB_PRAGMAS[3:],
+    )
+    db.connect()
+
+
+def _reset_locks():
+    # A lock held by another thread when the process forked
+    # would never be released in the child, as only the forking thread is copied
+    db._lock = threading.RLock()
+    RenderProfile.results_lock = threading.Lock()
+    Wiki.static_assets.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+
 from playhouse.sqlite_ext import (
     Model,
     TextField,
     DateTimeField,
-    ForeignKeyField,
     CharField,
     BooleanField,
     IntegerField,
 )
+from peewee import ForeignKeyAccessor, ForeignKeyField as _ForeignKeyField
 
 from utils import Unsafe
+from cache import RenderCache
+from assets import StaticAssets
 
 from html.parser import HTMLParser
 
@@ -56,6 +176,36 @@ class TagException(Exception):
     pass
 
 
+class RenderBudgetExceeded(Exception):
+    pass
+
+
+class LinkContext:
+    """
+    How rendered pages link to each other and to static files:
+    as served by the wiki, or as the files of a static export.
+    """
+
+    def __init__(self, export=False):
+        self.export = export
+
+
+# Each thread, and each render worker, has its own
+link_context: ContextVar = ContextVar("link_context", default=LinkContext())
+
+
+@contextmanager
+def export_links():
+    """
+    Render with the links of a static export, without affecting other requests.
+    """
+    token = link_context.set(LinkContext(export=True))
+    try:
+        yield
+    finally:
+        link_context.reset(token)
+
+
 class DocTagParser(HTMLParser):
     """
     Handles parsing for macro tags in documents.
@@ -88,37 +238,77 @@ class DocTagParser(HTMLParser):
         tag = None
         if "tag" in attrs:
             tag = attrs["tag"]
-            try:
-                # TODO: this kind of construction happens often enough that we should probably make a special constructor
-                self.query = (
-                    self.article.wiki.articles_tagged_with(tag)
-                    .where(
-                        Article.draft_of.is_null(),
-                        Article.revision_of.is_null(),
-                    )
-                    .order_by(SQL("title COLLATE NOCASE"))
+            self.article.depends_on("tag", tag)
+            wiki = self.article.wiki
+            sort_key = attrs.get("sort")
+            cache_key = ("articles", wiki.id, tag, sort_key)
+            listing = Wiki.article_cache.get(cache_key)
+            if listing is None:
+                stamp = Wiki.article_cache.stamp(wiki.id)
+                listing = self._tagged_articles(tag, sort_key)
+                Wiki.article_cache.set(
+                    cache_key,
+                    listing,
+                    [wiki.dependency("wiki"), wiki.dependency("tag", tag)]
+                    + [wiki.dependency("article", title) for title, _ in listing],
+                    stamp,
                 )
-            except Exception:
-                raise TagException(f"No such tag: {tag}")
 
         if not tag:
             raise TagException(f"Articles meta needs tag or other filter")
 
-        if self.query.count() > 0 and "sort" in attrs:
-            sort_key = attrs["sort"]
-            self.query = sorted(self.query, key=lambda x: x.get_metadata(sort_key, ""))
-
-        for __ in self.query:
-            __.formatted
-            blurb = __.get_metadata("@blurb")
+        for title, blurb in listing:
+            self.article.depends_on("article", title)
             blurb = f" -- {blurb}" if blurb else ""
-            self.results.append(f"* [[{__.title}]]{blurb}")
+            self.results.append(f"* [[{title}]]{blurb}")
+
+    def _tagged_articles(self, tag, sort_key=None):
+        """
+        Titles and blurbs of the live articles with a tag, fetched in one query.
+        """
+        wiki = self.article.wiki
+        try:
+            tag_id = Tag.get(Tag.title == tag, Tag.wiki == wiki).id
+        except Tag.DoesNotExist:
+            raise TagException(f"No such tag: {tag}")
+
+        def metadata_value(key):
+            return (
+                Metadata.select(Metadata.value)
+                .where(
+                    Metadata.item == Article._meta.table_name,
+                    Metadata.item_id == Article.id,
+                    Metadata.key == key,
+                )
+                .limit(1)
+            )
+
+        order = [SQL("title COLLATE NOCASE")]
+        if sort_key:
+            order.insert(0, fn.COALESCE(metadata_value(sort_key), ""))
+
+        return list(
+            Article.select(Article.title, metadata_value("@blurb"))
+            .where(
+                Article.wiki == wiki,
+                Article.id
+                << TagAssociation.select(TagAssociation.article).where(
+                    TagAssociation.tag == tag_id
+                ),
+                Article.draft_of.is_null(),
+                Article.revision_of.is_null(),
+            )
+            .order_by(*order)
+            .tuples()
+        )
 
     def _handle_meta(self, attrs):
         article = None
         for x in {"doc", "article", "item"}:
             if x in attrs:
                 article = attrs[x]
+                self.article.depends_on("title", article)
+                self.article.depends_on("article", article)
                 try:
                     self.query = self.article.wiki.articles.where(
                         Article.title == article,
@@ -137,6 +327,7 @@ class DocTagParser(HTMLParser):
                 key = attrs[x]
                 if not self.query:
                     self.query = self.article
+                    self.article.depends_on("article", self.article.title)
                 try:
                     self.query = self.query.get_metadata(key)
                 except KeyError:
@@ -154,15 +345,147 @@ class DocTagParser(HTMLParser):
             self.results.append(self.query)
 
 
+class MetadataPrefetch:
+    """
+    The metadata of a set of model instances, loaded in one query
+    the first time any of them asks for a key it covers.
+    """
+
+    # Ids per query, to stay well under SQLite's limit on parameters
+    CHUNK_SIZE = 500
+
+    def __init__(self, model, ids, keys=None):
+        self.model = model
+        self.ids = ids
+        self.keys = None if keys is None else frozenset(keys)
+        self.values = None
+
+    def covers(self, key) -> bool:
+        return self.keys is None or key in self.keys
+
+    def get(self, item_id, key, default=None):
+        if self.values is None:
+            self.load()
+        return self.values.get((item_id, key), default)
+
+    def load(self):
+        self.values = {}
+        for ids in chunked(self.ids, self.CHUNK_SIZE):
+            query = Metadata.select(
+                Metadata.item_id, Metadata.key, Metadata.value
+            ).where(
+                Metadata.item == self.model._meta.table_name,
+                Metadata.item_id << ids,
+            )
+            if self.keys is not None:
+                query = query.where(Metadata.key << list(self.keys))
+            for item_id, key, value in query.order_by(Metadata.id).tuples():
+                self.values.setdefault((item_id, key), value)
+
+
+class IdentityMapAccessor(ForeignKeyAccessor):
+    """
+    Loads related instances through the request's identity map, so that
+    articles in the same wiki, or by the same author, share one instance.
+    """
+
+    def get_rel_instance(self, instance):
+        value = instance.__data__.get(self.name)
+        if (
+            value is not None
+            and self.name not in instance.__rel__
+            and self.field.lazy_load
+            and self.field.rel_field is self.rel_model._meta.primary_key
+            and db.identities is not None
+        ):
+            related = self.rel_model.get_cached(value)
+            if related is not None:
+                instance.__rel__[self.name] = related
+        return super().get_rel_instance(instance)
+
+
+class ForeignKeyField(_ForeignKeyField):
+    accessor_class = IdentityMapAccessor
+
+
 class BaseModel(Model):
     _config = config
 
+    # Ids of instances looked up by a unique field, by (model, field name, value).
+    # These are kept across requests; the instances themselves are not.
+    _ids: dict = {}
+
+    # Set by prefetch_metadata
+    _metadata_prefetch: Optional[MetadataPrefetch] = None
+
     class ItemInUseError(Exception):
         pass
 
     class Meta:
         database = db
 
+    @property
+    def export_mode(self) -> bool:
+        return link_context.get().export
+
+    @classmethod
+    def get_cached(cls, id):
+        """
+        The instance with `id`, loaded at most once per request,
+        or None if there is none.
+        """
+        identities = db.identities
+        if identities is None:
+            return cls.get_or_none(cls._meta.primary_key == id)
+        try:
+            return identities[cls, id]
+        except KeyError:
+            pass
+        instance = cls.get_or_none(cls._meta.primary_key == id)
+        if instance is not None:
+            identities[cls, id] = instance
+        return instance
+
+    @classmethod
+    def get_by_unique(cls, field, value):
+        """
+        The instance whose `field`, which must be unique, is `value`.
+        Once its id is known, it is loaded by id through the identity map.
+        Raises DoesNotExist.
+        """
+        key = (cls, field.name, value)
+        id = BaseModel._ids.get(key)
+        if id is not None:
+            instance = cls.get_cached(id)
+            # Checked, in case it changed without the id being forgotten
+            if instance is not None and getattr(instance, field.name) == value:
+                return instance
+            BaseModel._ids.pop(key, None)
+        instance = cls.get(field == value)
+        BaseModel._ids[key] = instance.id
+        instance.remember()
+        return instance
+
+    @classmethod
+    def forget_id(cls, id):
+        """
+        Drop the remembered ids of the instance with `id`,
+        after it is renamed or deleted.
+        """
+        BaseModel._ids = {
+            k: v
+            for k, v in BaseModel._ids.copy().items()
+            if not (k[0] is cls and v == id)
+        }
+
+    def remember(self):
+        """
+        Add this instance to the request's identity map.
+        """
+        identities = db.identities
+        if identities is not None:
+            identities[type(self), self.id] = self
+
     @classmethod
     def title_to_html_keysafe(cls, title):
         return title.replace('"', "&quot;")
@@ -228,7 +551,25 @@ class BaseModel(Model):
     def metadata_not_autogen(self):
         return self.metadata.where(Metadata.autogen == False)
 
+    @classmethod
+    def prefetch_metadata(cls, instances, keys=None) -> list:
+        """
+        Serve get_metadata for `keys`, or for any key if None, on all of
+        `instances` from one query, run when the first of them needs it.
+        Returns the instances as a list.
+        """
+        instances = list(instances)
+        prefetch = MetadataPrefetch(
+            cls, [_.id for _ in instances if _.id is not None], keys
+        )
+        for instance in instances:
+            if instance.id is not None:
+                instance._metadata_prefetch = prefetch
+        return instances
+
     def get_metadata(self, key=None, default=None):
+        if key and self._metadata_prefetch and self._metadata_prefetch.covers(key):
+            return self._metadata_prefetch.get(self.id, key, default)
         metadata = self.metadata.select()
         if key:
             try:
@@ -249,6 +590,7 @@ class BaseModel(Model):
         else:
             metadata_item.value = value
         metadata_item.save()
+        self.metadata_changed()
 
     def delete_metadata(self, key):
         try:
@@ -257,6 +599,11 @@ class BaseModel(Model):
             return
         else:
             value.delete_instance()
+            self.metadata_changed()
+
+    def metadata_changed(self):
+        # Anything prefetched may be out of date
+        self._metadata_prefetch = None
 
 
 class Wiki(BaseModel):
@@ -265,14 +612,18 @@ class Wiki(BaseModel):
 
     config = config
 
-    _sidebar_cache: dict = {}
-    article_cache: dict = {}
+    # Sizes are in bytes
+    _sidebar_cache = RenderCache(getattr(config, "SIDEBAR_CACHE_SIZE", 16 * 1024**2))
+    article_cache = RenderCache(getattr(config, "ARTICLE_CACHE_SIZE", 64 * 1024**2))
+    static_assets = StaticAssets(
+        Path(__file__).parent / "static", Path(config.DATA_PATH, "static-cache")
+    )
+    _render_versions: dict = {}
+    _render_stale: set = set()
 
     PATH = "/wiki/<wiki_title>"
     METADATA = "wiki"
 
-    export_mode = False
-
     settings = settings
 
     @property
@@ -287,9 +638,12 @@ class Wiki(BaseModel):
             .order_by(ArticleLinks.link.asc())
         )
 
-    def stylesheet(self):
+    def stylesheet(self, dependencies: Optional[set] = None):
         style_data = []
 
+        if dependencies is not None:
+            dependencies.add(self.dependency("tag", "@style"))
+
         try:
             style_articles = Tag.get(wiki=self, title="@style").articles
         except Tag.DoesNotExist:
@@ -297,22 +651,36 @@ class Wiki(BaseModel):
         else:
             for a in style_articles:
                 style_data.append(a.article.content)
+                if dependencies is not None:
+                    dependencies.add(self.dependency("article", a.article.title))
 
         style_data = "".join(style_data)
 
         return style_data
 
-    def delete_(self):
+    def delete_(self, job=None):
+        """
+        Delete the wiki and everything in it. If `job` is given, its progress
+        is updated, and it can be cancelled until the media start being deleted.
+        """
         with db.transaction():
             Metadata.delete().where(
                 Metadata.item == "wiki",
                 Metadata.id == self.id,
             )
 
-            for article in self.articles:
+            articles = list(self.articles)
+            if job is not None:
+                job.total = len(articles)
+
+            for article in articles:
+                if job is not None:
+                    # Cancelling rolls back the transaction, so nothing is lost
+                    job.check()
+                    job.advance()
                 article.delete_()
 
-            for media in self.media:
+            for media in list(self.media):
                 media.delete_()
 
             try:
@@ -324,16 +692,112 @@ class Wiki(BaseModel):
 
             self.delete_instance()
 
+        Wiki.forget_id(self.id)
+        Wiki.article_cache.invalidate(self.dependency("wiki"))
+
     @property
     def sidebar_cache(self):
-        return Wiki._sidebar_cache.get(self.id, None)
+        if self.export_mode:
+            return None
+        return Wiki._sidebar_cache.get(self.id)
+
+    def save(self, *a, **ka):
+        renamed = self.id is not None and "title" in self._dirty
+        result = super().save(*a, **ka)
+        if renamed:
+            Wiki.forget_id(self.id)
+            # Every link in every article of the wiki changes with its title
+            Wiki.article_cache.invalidate(self.dependency("wiki"))
+        return result
+
+    @classmethod
+    def get_by_title(cls, title) -> "Wiki":
+        """
+        The wiki titled `title`. Raises Wiki.DoesNotExist.
+        """
+        return cls.get_by_unique(cls.title, title)
+
+    def dependency(self, kind, name=None) -> tuple:
+        """
+        Key for something in this wiki that cached renders can depend on.
+        """
+        return (self.id, kind, name)
 
     def invalidate_cache(self):
+        """
+        Drop the cached sidebar for this wiki, and the pages it appears in.
+        Article renders are evicted separately, as the things they depend on change.
+        """
+        Wiki._sidebar_cache.discard(self.id)
+        Wiki.article_cache.invalidate(self.dependency("sidebar"))
+        if self.id in Wiki._render_stale:
+            self.bump_render_version()
+
+    def invalidate_renders(self, *dependencies, stale=False):
+        """
+        Evict cached renders that depend on any of `dependencies`.
+        If `stale` is set, every render persisted for this wiki is also invalidated,
+        for changes that the dependencies of persisted renders don't record.
+        """
+        Wiki.article_cache.invalidate(*[self.dependency(*_) for _ in dependencies])
+        if stale:
+            self.mark_renders_stale()
+
+    def discard_persisted_renders(self, *dependencies):
+        """
+        Clear the persisted renders in this wiki that depend on any of `dependencies`.
+        """
+        for kind, name in dependencies:
+            dependents = RenderDependency.select(RenderDependency.article).where(
+                RenderDependency.kind == kind, RenderDependency.name == str(name)
+            )
+            Article.update(rendered_content=None).where(
+                Article.wiki == self, Article.id << dependents
+            ).execute()
+
+    @property
+    def render_version(self) -> int:
+        """
+        Version stamp for what article renders depend on besides their own text.
+        Persisted renders made under an older version are discarded.
+        """
+        if self.id in Wiki._render_stale:
+            self.bump_render_version()
         try:
-            del Wiki._sidebar_cache[self.id]
+            return Wiki._render_versions[self.id]
         except KeyError:
             pass
-        Wiki.article_cache = {}
+        version = int(self.get_metadata("@render-version", 0))
+        Wiki._render_versions[self.id] = version
+        return version
+
+    def mark_renders_stale(self):
+        """
+        Flag that something other articles can render has changed.
+        The version bump is deferred, so a burst of changes costs only one write.
+        """
+        Wiki._render_stale.add(self.id)
+
+    def bump_render_version(self):
+        Wiki._render_stale.discard(self.id)
+        try:
+            version = Wiki._render_versions[self.id]
+        except KeyError:
+            version = int(self.get_metadata("@render-version", 0))
+        version += 1
+        self.set_metadata("@render-version", version)
+        Wiki._render_versions[self.id] = version
+
+    def rebuild_render_cache(self):
+        """
+        Render every article in this wiki and persist the results.
+        Returns the number of articles rendered.
+        """
+        count = 0
+        for article in self.articles.where(Article.content.is_null(False)):
+            article.rerender()
+            count += 1
+        return count
 
     @classmethod
     def new_wiki(cls, title, description, author, first_wiki=False, empty=False):
@@ -417,37 +881,37 @@ class Wiki(BaseModel):
 
     @property
     def static_folder_link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             return f"../static"
-        return "/static"
+        return f"/static/{Wiki.static_assets.fingerprint}"
 
     @property
     def link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             return f".."
         return f"/wiki/{self.title_to_url(self.title)}"
 
     @property
     def homepage_link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             return f"{self.article_root_link}/{self.main_article.file_to_url}.html"
         return self.link
 
     @property
     def server_homepage_link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             return f"{self.article_root_link}/{self.main_article.file_to_url}.html"
         return "/"
 
     @property
     def article_root_link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             return "../article"
         return f"{self.link}/article"
 
     @property
     def tag_root_link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             return "../tag"
         return f"{self.link}/tag"
 
@@ -500,6 +964,14 @@ class Wiki(BaseModel):
     def media_paste_link(self):
         return f"{self.link}/media-paste"
 
+    @property
+    def render_profile_link(self):
+        return f"{self.link}/render-profile"
+
+    @property
+    def sidebar_link(self):
+        return f"{self.link}/sidebar"
+
     @classmethod
     def default(cls):
         return cls(
@@ -526,7 +998,11 @@ class Wiki(BaseModel):
 
     @property
     def last_edited(self):
-        return self.recent_articles()[0].last_edited.strftime(ARTICLE_TIME_FORMAT)
+        article = self.recent_articles().first()
+        # A wiki that is still being created from a template may have none yet
+        if article is None:
+            return ""
+        return article.last_edited.strftime(ARTICLE_TIME_FORMAT)
 
     def articles_tagged_with(self, tag):
         try:
@@ -599,8 +1075,14 @@ class Article(BaseModel):
     revision_of = ForeignKeyField("self", null=True, backref="revisions")
     new_title = TextField(null=True)
 
+    class Meta:
+        indexes = ((("wiki", "title"), False),)
+
     PATH = "/article/<article_title>"
 
+    # Why the last render was stopped short, if it was
+    render_error: Optional[str] = None
+
     # HTML not handled by Markdown directly
     checkbox_re = re.compile(r"\[([xX_ ])\]")
     strike_re = re.compile(r"\~\~(.*?)\~\~")
@@ -636,7 +1118,85 @@ class Article(BaseModel):
     literal_block_re = re.compile(r"(```)")
     literal_inline_re = re.compile(r"(`)")
 
-    def make_revision(self):
+    # Table cell text that may not be a single paragraph: blank, more than one line,
+    # indented, starting with a character commonmark checks for block starts,
+    # or possibly a link reference definition
+    cell_block_re = re.compile(
+        r"^ {0,3}(?:[#`~*+_=<>0-9\t\f\v-]|\[.*\]:|$)|^ {4}|[\r\n\0]"
+    )
+    # Table cell text that commonmark renders unchanged
+    plain_cell_re = re.compile(r"[^`\[\]\\!<>&*_'\"]*")
+
+    # A run of consecutive lines starting with "|", using the same
+    # line boundaries as str.splitlines()
+    _line_breaks = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+    table_re = re.compile(
+        rf"(?<![^{_line_breaks}])\|[^{_line_breaks}]*"
+        rf"(?:(?:\r\n|[{_line_breaks}])\|[^{_line_breaks}]*)*"
+        rf"(?:\r\n|[{_line_breaks}])?"
+    )
+
+    # Inline formatting passes, applied in turn to the whole of each region,
+    # with the name of the handler for each. Each pass sees the output of
+    # the ones before it.
+    inline_stages = (
+        (include_re, "_include_re"),
+        (metadata_cleared_re, "_metadata_cleared_re"),
+        (metadata_re, "_metadata_re"),
+        (blurb_re, "_blurb_re"),
+        (function_re, "_function_re"),
+        (table_re, "_table_re"),
+        # Named links first, so that bare ones don't take their text
+        (wikilink_re, "_wikilink_re"),
+        (wikilink_re, "_wikilink_bare_re"),
+        (media_re, "_media_re"),
+        (strike_re, "_strike_re"),
+        (checkbox_re, "_checkbox_re"),
+    )
+
+    def save(self, *a, **ka):
+        dependencies = []
+        if self.id is None or "title" in self._dirty:
+            titles = {self.title}
+            if self.id is not None:
+                titles.add(
+                    Article.select(Article.title).where(Article.id == self.id).scalar()
+                )
+            for title in titles:
+                dependencies += [("title", title), ("article", title)]
+        elif "content" in self._dirty:
+            dependencies.append(("article", self.title))
+        result = super().save(*a, **ka)
+        self.dependency_changed(*dependencies)
+        return result
+
+    def dependency_changed(self, *dependencies):
+        """
+        Evict cached renders of this article, and of anything that depends on `dependencies`,
+        and discard the persisted renders that depend on them.
+        """
+        self.wiki.invalidate_renders(("id", self.id), *dependencies)
+        if dependencies and self.is_live:
+            self.wiki.discard_persisted_renders(*dependencies)
+
+    def metadata_changed(self):
+        super().metadata_changed()
+        self.dependency_changed(("article", self.title))
+
+    def depends_on(self, kind, name):
+        """
+        Record something the render in progress depends on.
+        """
+        self.render_dependencies.add((kind, name))
+
+    @property
+    def is_live(self):
+        """
+        Drafts and revisions are never the targets of links, macros or includes.
+        """
+        return self.draft_of_id is None and self.revision_of_id is None
+
+    def make_revision(self, update=True):
         revision = Article(
             wiki=self.wiki,
             title=self.title,
@@ -646,8 +1206,9 @@ class Article(BaseModel):
             revision_of=self,
         )
         revision.save()
-        revision.update_links()
-        revision.update_autogen_metadata()
+        if update:
+            revision.update_links()
+            revision.update_autogen_metadata()
         revision.copy_metadata_from(self)
         revision.copy_tags_from(self)
 
@@ -691,7 +1252,7 @@ class Article(BaseModel):
         return f"{self.revision_of.link}/revision/{self.id}"
 
     def copy_metadata_from(self, other):
-        for metadata in other.metadata_not_autogen:
+        for metadata in list(other.metadata_not_autogen):
             self.set_metadata(metadata.key, metadata.value)
 
     def clear_index(self):
@@ -710,11 +1271,11 @@ class Article(BaseModel):
         )
         new_form_article.save()
 
-        for tag in self.tags:
+        for tag in list(self.tags):
             if tag.tag.title not in {"@form", "@template"}:
                 new_form_article.add_tag(tag.tag.title)
 
-        for metadata in self.metadata_not_autogen:
+        for metadata in list(self.metadata_not_autogen):
             new_form_article.set_metadata(metadata.key, metadata.value)
 
         new_form_article.update_index()
@@ -724,16 +1285,25 @@ class Article(BaseModel):
 
         return new_form_article
 
-    def update_autogen_metadata(self):
-        if getattr(self, "autogen_metadata", None) is None:
-            _ = self.formatted
-        for _ in self.metadata.where(Metadata.autogen == True):
+    def update_autogen_metadata(self, autogen_metadata=None):
+        if autogen_metadata is not None:
+            self.autogen_metadata = autogen_metadata
+        elif getattr(self, "autogen_metadata", None) is None:
+            self.rerender()
+        if self.render_error is not None:
+            # Keep the metadata from the last complete render
+            return
+        existing = []
+        for _ in list(self.metadata.where(Metadata.autogen == True)):
+            existing.append((_.key, _.value))
             _.delete_instance()
         for key, value in self.autogen_metadata:
             new_metadata = Metadata(
                 item="article", item_id=self.id, key=key, value=value, autogen=True
             )
             new_metadata.save()
+        if existing != [(key, str(value)) for key, value in self.autogen_metadata]:
+            self.metadata_changed()
 
     @property
     def tags_alpha(self):
@@ -761,6 +1331,7 @@ class Article(BaseModel):
         except TagAssociation.DoesNotExist:
             tag_association = TagAssociation(tag=tag_to_add, article=self)
             tag_association.save()
+            self.dependency_changed(("tag", tag_title))
         return tag_association
 
     def remove_tag(self, tag_title):
@@ -777,9 +1348,11 @@ class Article(BaseModel):
 
         tag_assoc_to_remove.delete_instance()
 
-        for _ in Tag.orphans():
+        for _ in list(Tag.orphans()):
             _.delete_instance()
 
+        self.dependency_changed(("tag", tag_title))
+
         return True
 
     def has_name_collision(self):
@@ -850,7 +1423,7 @@ class Article(BaseModel):
 
     @property
     def link(self):
-        if Wiki.export_mode:
+        if self.export_mode:
             article_title = self.title_to_url(self.title).replace("%", "%25")
             return f"{self.wiki.article_root_link}/{article_title}.html"
         return f"{self.wiki.article_root_link}/{self.title_to_url(self.title)}"
@@ -897,46 +1470,63 @@ class Article(BaseModel):
             self.clear_tags()
             self.clear_links()
             self.delete_instance(recursive=True)
+            self.dependency_changed(("title", self.title), ("article", self.title))
 
     def clear_metadata(self):
-        for _ in self.metadata:
+        metadata = list(self.metadata)
+        for _ in metadata:
             _.delete_instance()
+        if metadata:
+            self.metadata_changed()
 
     def clear_tags(self):
-        for tag in self.tags:
+        tag_titles = [("tag", tag.title) for tag in self.tags_alpha]
+
+        for tag in list(self.tags):
             tag.delete_instance()
 
-        for _ in Tag.orphans():
+        if tag_titles:
+            self.dependency_changed(*tag_titles)
+
+        for _ in list(Tag.orphans()):
             _.delete_instance()
 
     def copy_tags_from(self, other):
-        for tag_assoc in other.tags:
+        for tag_assoc in list(other.tags):
             self.add_tag(tag_assoc.tag.title)
 
     def clear_links(self):
         ArticleLinks.delete().where(ArticleLinks.article == self).execute()
         MediaLinks.delete().where(MediaLinks.article == self).execute()
 
-    def update_links(self):
+    def update_links(self, html=None):
         article_link_path = self.wiki.article_root_link
+
+        if html is None:
+            html = self.formatted
+        if self.render_error is not None:
+            # Keep the links from the last complete render
+            return
         self.clear_links()
 
-        for _ in self.href_re.finditer(self.formatted):
+        links = []
+        link_resolver = LinkResolver(self.wiki)
+
+        for _ in self.href_re.finditer(html):
             link_item = _.group(2)
             if link_item.startswith(article_link_path):
                 link_extracted = Wiki.url_to_title(link_item.rsplit("/", 1)[1])
-                new_link = ArticleLinks(article=self)
-                if self.wiki.article_exists(link_extracted):
-                    new_link.valid_link = (
-                        Article.select(Article.id)
-                        .where(
-                            Article.title == link_extracted, Article.wiki == self.wiki
-                        )
-                        .get()
-                    )
-                else:
-                    new_link.link = link_extracted
-                new_link.save()
+                link_resolver.add("title", link_extracted)
+                links.append(link_extracted)
+
+        for link_extracted in links:
+            new_link = ArticleLinks(article=self)
+            article_id = link_resolver.get("title", link_extracted)
+            if article_id is not None:
+                new_link.valid_link = article_id
+            else:
+                new_link.link = link_extracted
+            new_link.save()
 
         for _ in self.media_re.finditer(self.content):
             try:
@@ -950,16 +1540,144 @@ class Article(BaseModel):
 
             new_link.save()
 
+    @property
+    def render_key(self):
+        """
+        Hash of the article text and of everything else its render depends on.
+        """
+        h = blake2b(digest_size=16)
+        h.update(
+            bytes(
+                f"{settings.RENDER_VERSION}\0{self.wiki.render_version}\0{self.wiki.link}\0{self.content}",
+                "utf8",
+            )
+        )
+        return h.hexdigest()
+
+    @property
+    def render_cacheable(self):
+        return (
+            self.id is not None
+            and self.content is not None
+            and "content" not in self._dirty
+            and not self.export_mode
+        )
+
+    def rerender(self):
+        """
+        Render the article from scratch, and cache the result if possible.
+        """
+        stamp = Wiki.article_cache.stamp(self.wiki_id)
+        html = self._formatted(self.content)
+        self.store_render(html, self.render_dependencies, stamp)
+        return html
+
+    def store_render(self, html, dependencies, stamp=None):
+        """
+        Save and cache a render of the article's current content, if possible.
+        Renders that were cut short, with no `dependencies`, are not kept,
+        nor are renders begun before `stamp` stopped being current.
+        """
+        if dependencies is None or not self.render_cacheable:
+            return
+        dependencies = sorted(dependencies)
+        rendered_content = "\n".join((self.render_key, json.dumps(dependencies), html))
+        if stamp is not None and not Wiki.article_cache.is_current(stamp):
+            return
+        # Not under the cache lock, as invalidations take it inside transactions
+        with db.atomic():
+            Article.update(rendered_content=rendered_content).where(
+                Article.id == self.id
+            ).execute()
+            RenderDependency.record(self.id, dependencies)
+        if stamp is not None and not Wiki.article_cache.is_current(stamp):
+            # Invalidated while saving, perhaps before the render was there to discard
+            Article.update(rendered_content=None).where(
+                Article.id == self.id, Article.rendered_content == rendered_content
+            ).execute()
+            return
+        self.rendered_content = rendered_content
+        # Checks the stamp again under the cache lock
+        self._cache_render(html, dependencies, stamp)
+
+    def _cache_render(self, html, dependencies, stamp=None):
+        Wiki.article_cache.set(
+            ("body", self.id), html, self._body_dependencies(dependencies), stamp
+        )
+
+    def _body_dependencies(self, dependencies) -> frozenset:
+        """
+        Cache dependencies of a render of the article's text that depended
+        on `dependencies`.
+        """
+        wiki = self.wiki
+        return frozenset(
+            [wiki.dependency(kind, name) for kind, name in dependencies or ()]
+            + [wiki.dependency("wiki"), wiki.dependency("id", self.id)]
+        )
+
+    def _load_render(self):
+        """
+        The persisted render of the article, if it is still current,
+        or else a new one, along with its cache dependencies.
+        """
+        stamp = Wiki.article_cache.stamp(self.wiki_id)
+        # Read again, as it may have been discarded since the article was loaded
+        rendered_content = (
+            Article.select(Article.rendered_content)
+            .where(Article.id == self.id)
+            .scalar()
+        )
+        if rendered_content:
+            key, dependencies, html = rendered_content.split("\n", 2)
+            if key == self.render_key:
+                dependencies = json.loads(dependencies)
+                self._cache_render(html, dependencies, stamp)
+                return html, self._body_dependencies(dependencies)
+        html = self._formatted(self.content)
+        self.store_render(html, self.render_dependencies, stamp)
+        return html, self._body_dependencies(self.render_dependencies)
+
     @property
     def formatted(self):
-        return self._formatted(self.content)
+        if not self.render_cacheable:
+            html = self._formatted(self.content)
+            self.body_dependencies = self._body_dependencies(self.render_dependencies)
+            return html
+        # Kept from the same lookup as the text, which may be evicted at any time
+        html, self.body_dependencies = Wiki.article_cache.get_or_render(
+            ("body", self.id), self._load_render, dependencies=True
+        )
+        return html
+
+    @property
+    def page_dependencies(self) -> set:
+        """
+        Everything a full page view of this article depends on.
+        """
+        wiki = self.wiki
+        if getattr(self, "body_dependencies", None) is None:
+            self.formatted
+        dependencies = set(self.body_dependencies)
+        dependencies.update(
+            (
+                wiki.dependency("wiki"),
+                wiki.dependency("sidebar"),
+                wiki.dependency("id", self.id),
+                wiki.dependency("tag", self.title),
+            )
+        )
+        for tag in self.tags_alpha:
+            dependencies.add(wiki.dependency("title", tag.title))
+        return dependencies
 
     def _function_re(self, matchobj):
-        query_iter = []
-        tag = matchobj.group(0)[1:-1]
-        parser = DocTagParser(self)
-        parser.feed(tag)
-        return parser.render()
+        with self._render_stage("macros"):
+            query_iter = []
+            tag = matchobj.group(0)[1:-1]
+            parser = DocTagParser(self)
+            parser.feed(tag)
+            return parser.render()
 
     def _article_re(self, matchobj):
         return f"({self.wiki.article_root_link}/{matchobj.group(1)})"
@@ -970,64 +1688,64 @@ class Article(BaseModel):
             url = f"{self.wiki.link}/media/{self.wiki.file_to_url(url)}"
         return f"![{matchobj.group(1)}]({url})"
 
+    def _link_target(self, link):
+        """
+        The kind ("title" or "tag") and name of the wiki item an href points to.
+        Anchors and external links have no kind.
+        """
+        if link.startswith(("#", "http://", "https://")):
+            return None, link
+        if link.startswith(f"{self.wiki.article_root_link}/"):
+            link_to_find = link.split(f"{self.wiki.article_root_link}/")[1]
+            return "title", self.url_to_title(link_to_find)
+        if link.startswith(f"{self.wiki.link}/new_from_form/"):
+            link_to_find = link.split(f"{self.wiki.link}/new_from_form/")[1]
+            return "title", self.url_to_title(link_to_find.split("/", 1)[0])
+        if link.startswith(f"{self.wiki.tag_root_link}"):
+            return "tag", self.url_to_title(link.split(f"/tag/")[1])
+        return "title", link
+
     def _href_re(self, matchobj):
         link = matchobj.group(2)
         target = ""
-        export_mode_extension = ".html" if Wiki.export_mode else ""
+        export_mode_extension = ".html" if self.export_mode else ""
+        kind, link_to_find = self._link_target(link)
 
-        # Article-internal anchors are a special case
-        if link.startswith("#"):
-            link_title = link
-            link_test = link
-            link_class = "wiki-link"
-            link_to_render = link
-            valid_title = link
-        elif link.startswith(("http://", "https://")):
-            link_class = "wiki-external-link"
-            link_title = link
-            link_test = link
-            valid_title = link
-            link_to_render = link
-            target = ' target="_blank"'
-        elif link.startswith(f"{self.wiki.article_root_link}/"):
-            link_to_find = link.split(f"{self.wiki.article_root_link}/")[1]
+        if kind is None:
+            link_test = True
             link_to_render = link
-            link_to_find = self.url_to_title(link_to_find)
-            link_test = self.wiki.article_exists(link_to_find)
-            link_class = "wiki-link"
-            valid_title = link_to_find
-        elif link.startswith(f"{self.wiki.link}/new_from_form/"):
-            link_to_find = link.split(f"{self.wiki.link}/new_from_form/")[1]
-            link_to_render = link
-            link_class = "wiki-link"
-            link_with_opt_name = link_to_find.split("/", 1)
-            if len(link_with_opt_name) > 1:
-                link_to_find = self.url_to_title(link_with_opt_name[0])
+            # Article-internal anchors are a special case
+            if link.startswith("#"):
+                link_class = "wiki-link"
             else:
-                link_to_find = self.url_to_title(link_to_find)
-            link_test = self.wiki.article_exists(link_to_find)
-            valid_title = link_to_find
-        elif link.startswith(f"{self.wiki.tag_root_link}"):
-            link_to_find = link.split(f"/tag/")[1]
-            link_to_render = f"{self.wiki.tag_root_link}/{link_to_find}"
-            link_to_find = self.url_to_title(link_to_find)
-            link_test = self.wiki.tag_exists(link_to_find)
-            valid_title = link_to_find
-            link_class = "wiki-tag-link"
+                link_class = "wiki-external-link"
+                target = ' target="_blank"'
         else:
-            link_to_show = self.title_to_url(link)
-            link_to_render = f"{self.wiki.article_root_link}/{link_to_show}"
-            link_test = self.wiki.article_exists(link)
-            link_class = "wiki-link"
-            valid_title = link
+            self.depends_on(kind, link_to_find)
+            link_test = self.render_context.links.exists(kind, link_to_find)
+            if kind == "tag":
+                link_to_render = f"{self.wiki.tag_root_link}/{link.split(f'/tag/')[1]}"
+                link_class = "wiki-tag-link"
+            else:
+                if link.startswith(
+                    (
+                        f"{self.wiki.article_root_link}/",
+                        f"{self.wiki.link}/new_from_form/",
+                    )
+                ):
+                    link_to_render = link
+                else:
+                    link_to_show = self.title_to_url(link)
+                    link_to_render = f"{self.wiki.article_root_link}/{link_to_show}"
+                link_class = "wiki-link"
 
         if link_test:
-            link_title = valid_title
+            link_title = link_to_find
         else:
             link_class = "wiki-missing-link"
             link_title = f"{link} (nonexistent article)"
 
-        if Wiki.export_mode:
+        if self.export_mode:
             link_to_render = link_to_render.replace("%", "%25")
 
         link_title = link_title.replace('"', r"\"")
@@ -1038,15 +1756,30 @@ class Article(BaseModel):
         return f'{matchobj.group(1)}title="{link_title}" class="{link_class}" href="{link_to_render}{export_mode_extension}"{target}{matchobj.group(3)}'
 
     def _include_re(self, matchobj):
-        replace = matchobj.group(0)
+        with self._render_stage("includes"):
+            return self._include(matchobj)
+
+    def _include(self, matchobj):
         include = matchobj.group(1)
-        try:
-            article = Article.get(Article.title == include, Article.wiki == self.wiki)
-        except Article.DoesNotExist:
+        self.depends_on("title", include)
+        self.depends_on("article", include)
+        render_context = self.render_context
+        if include in render_context.including:
+            return f"<inline-error>[Circular include: {include}]</inline-error>"
+        content = render_context.include(include)
+        if content is None:
             return (
                 f"<inline-error>[No such article to include: {include}]</inline-error>"
             )
-        return article.content
+        render_context.expand(len(content))
+        # Includes in the included article are expanded in turn
+        render_context.including.append(include)
+        try:
+            return self.include_re.sub(
+                self._include, content, **render_context.regex_budget(content)
+            )
+        finally:
+            render_context.including.pop()
 
     def _wikilink_bare_re(self, matchobj):
         return self._wikilink_re(matchobj, False)
@@ -1061,19 +1794,24 @@ class Article(BaseModel):
             else:
                 source_link = matchobj.group(1)
 
+        final_link = f"[{source_name}]({self._wikilink_url(source_link)})"
+
+        return final_link
+
+    def _wikilink_url(self, source_link):
         source_link = source_link.replace(r"\(", "(").replace(r"\)", ")")
 
         if source_link.startswith("http://") or source_link.startswith("https://"):
             newlink = source_link
         elif source_link.startswith("/tag/"):
             newlink = source_link.split("/tag/", 1)[1]
-            newlink = f"{self.wiki.tag_root_link}/{self.title_to_url(newlink)}"
+            newlink = (
+                f"{self.render_context.tag_root_link}/{self.title_to_url(newlink)}"
+            )
         else:
-            newlink = f"{self.wiki.article_root_link}/{self.title_to_url(source_link)}"
+            newlink = f"{self.render_context.article_root_link}/{self.title_to_url(source_link)}"
 
-        final_link = f"[{source_name}]({newlink})"
-
-        return final_link
+        return newlink
 
     def _blurb_re(self, matchobj):
         Wiki.title_to_url
@@ -1127,14 +1865,13 @@ class Article(BaseModel):
                 else:
                     col_type = "td"
                 line = _.split("|")[1:-1]
-                table_line = "".join(
-                    ["<tr>"]
-                    + [
-                        f"<{col_type}>{dummy._formatted(cell)[3:-5]}</{col_type}>"
-                        for cell in line
-                    ]
-                    + ["</tr>"]
-                )
+                cells = []
+                for cell in line:
+                    cells.append(
+                        f"<{col_type}>{dummy._formatted(cell, self.render_context, True)[3:-5]}</{col_type}>"
+                    )
+                    self.render_dependencies |= dummy.render_dependencies
+                table_line = "".join(["<tr>"] + cells + ["</tr>"])
                 table_fmt.append(table_line)
                 if header_row:
                     table_fmt.append("</thead><tbody>")
@@ -1187,33 +1924,108 @@ class Article(BaseModel):
 
         return raw_content
 
+    def _table_re(self, matchobj):
+        with self._render_stage("tables"):
+            return self._format_table(matchobj.group(0))
+
     def _inline_format(self, inline):
-        inline = self.include_re.sub(self._include_re, inline)
-        inline = self.metadata_cleared_re.sub(self._metadata_cleared_re, inline)
-        inline = self.metadata_re.sub(self._metadata_re, inline)
-        inline = self.blurb_re.sub(self._blurb_re, inline)
-        inline = self.function_re.sub(self._function_re, inline)
-        inline = self._format_table(inline)
-        inline = self.wikilink_re.sub(self._wikilink_re, inline)
-        inline = self.wikilink_re.sub(self._wikilink_bare_re, inline)
-        inline = self.media_re.sub(self._media_re, inline)
-        inline = self.strike_re.sub(self._strike_re, inline)
-        inline = self.checkbox_re.sub(self._checkbox_re, inline)
+        render_context = self.render_context
+        for pattern, handler in self.inline_stages:
+            # The time left is checked once per pass, rather than per match
+            inline = pattern.sub(
+                getattr(self, handler), inline, **render_context.regex_budget(inline)
+            )
         return inline
 
-    def _formatted(self, raw_content):
+    @staticmethod
+    def _parse_paragraph(text):
+        """
+        Parse text that forms a single paragraph, without the block parser.
+        """
+        ast = commonmark.node.Node("document", [[1, 1], [0, 0]])
+        paragraph = commonmark.node.Node("paragraph", [[1, 1], [0, 0]])
+        paragraph.string_content = text
+        ast.append_child(paragraph)
+        parser.inline_parser.refmap = {}
+        parser.inline_parser.parse(paragraph)
+        return ast
+
+    def _formatted(self, raw_content, render_context=None, table_cell=False):
         self.autogen_metadata = []
+        self.render_dependencies = set()
 
-        raw_content = self._content_regions(raw_content, self._inline_format)
+        if render_context is not None:
+            self.render_context = render_context
+            return self._render(raw_content, table_cell)
 
-        ast = parser.parse(raw_content)
-        html = renderer.render(ast)
+        self.render_context = render_context = RenderContext(self)
+        self.render_error = None
+        profile = render_context.profile
+        if profile is not None:
+            self.render_profile = profile
+        try:
+            render_context.expand(len(raw_content))
+            return self._render(raw_content)
+        except TimeoutError:
+            self.render_error = render_context.timed_out
+        except RenderBudgetExceeded as e:
+            self.render_error = str(e)
+        finally:
+            if profile is not None:
+                profile.finish(self)
+
+        # What was gathered before the render stopped is incomplete
+        self.autogen_metadata = []
+        self.render_dependencies = None
+        return f"<p><inline-error>[{self.render_error}]</inline-error></p>\n"
+
+    def _render(self, raw_content, table_cell=False):
+        render_context = self.render_context
+        budget = render_context.regex_budget(raw_content)
+
+        # Table cells share the context, and the targets, of their article
+        if not table_cell:
+            with self._render_stage("prefetch"):
+                # Gather wikilink and include targets up front,
+                # so they are looked up in batches
+                for match in self.wikilink_re.finditer(raw_content, **budget):
+                    link = self._wikilink_url(match.group(2) or match.group(1))
+                    render_context.links.add(*self._link_target(link))
+                for match in self.include_re.finditer(raw_content, **budget):
+                    render_context.add_include(match.group(1))
+
+        with self._render_stage("inline"):
+            raw_content = self._content_regions(raw_content, self._inline_format)
+            render_context.check_size(len(raw_content))
+
+        with self._render_stage("commonmark"):
+            # Most table cells are a single paragraph, which needs no block parsing
+            if table_cell and not self.cell_block_re.search(raw_content):
+                raw_content = raw_content.strip()
+                if self.plain_cell_re.fullmatch(raw_content):
+                    return f"<p>{raw_content}</p>\n"
+                ast = self._parse_paragraph(raw_content)
+            else:
+                ast = parser.parse(raw_content)
+            html = renderer.render(ast)
 
-        html = self.href_re.sub(self._href_re, html)
-        html = html.replace("<img ", '<img class="img-fluid" ')
+        with self._render_stage("links"):
+            budget = render_context.regex_budget(html)
+            for match in self.href_re.finditer(html, **budget):
+                render_context.links.add(*self._link_target(match.group(2)))
+            html = self.href_re.sub(self._href_re, html, **budget)
+            html = html.replace("<img ", '<img class="img-fluid" ')
 
         return html
 
+    _no_stage = nullcontext()
+
+    def _render_stage(self, name):
+        profile = self.render_context.profile
+        if profile is None:
+            return self._no_stage
+        return profile.stage(name)
+
     def rename_inbound_links(self, old_name, new_name):
         """
         - get all articles that link to this one
@@ -1229,11 +2041,17 @@ class Metadata(BaseModel):
     value = TextField()
     autogen = BooleanField(default=False)
 
+    class Meta:
+        indexes = ((("item", "item_id", "key"), False),)
+
 
 class Tag(BaseModel):
     title = TextField()
     wiki = ForeignKeyField(Wiki, backref="tags")
 
+    class Meta:
+        indexes = ((("wiki", "title"), False),)
+
     @classmethod
     def search(cls, search_set, search_query):
         return (
@@ -1284,12 +2102,248 @@ class ArticleLinks(BaseModel):
     # Textual link, if the target article does not exist
 
 
+class LinkResolver:
+    """
+    Looks up which link targets exist in a wiki.
+
+    Targets are gathered with `add()` and looked up together on first use,
+    with one query per kind rather than one per link.
+    """
+
+    # Stays under SQLite's limit on the number of query parameters
+    batch_size = 500
+
+    def __init__(self, wiki):
+        self.wiki = wiki
+        self.pending: dict = {"title": set(), "tag": set()}
+        self.found: dict = {"title": {}, "tag": {}}
+
+    def add(self, kind, name):
+        if kind is not None and name not in self.found[kind]:
+            self.pending[kind].add(name)
+
+    def get(self, kind, name):
+        """
+        Id of the article or tag with the given name, or None if there isn't one.
+        """
+        try:
+            return self.found[kind][name]
+        except KeyError:
+            pass
+        self.add(kind, name)
+        self.resolve()
+        return self.found[kind][name]
+
+    def exists(self, kind, name):
+        return self.get(kind, name) is not None
+
+    def resolve(self):
+        for kind, model in (("title", Article), ("tag", Tag)):
+            names = list(self.pending[kind])
+            self.pending[kind].clear()
+            found = self.found[kind]
+            for index in range(0, len(names), self.batch_size):
+                batch = names[index : index + self.batch_size]
+                for name, id in (
+                    model.select(model.title, model.id)
+                    .where(model.wiki == self.wiki, model.title.in_(batch))
+                    .order_by(model.id)
+                    .tuples()
+                ):
+                    found.setdefault(name, id)
+                for name in batch:
+                    found.setdefault(name, None)
+
+
+class RenderContext:
+    """
+    State shared by everything rendered as part of one article:
+    link targets, included articles, the includes being expanded,
+    and what is left of the time and size allowed for the render.
+    """
+
+    # Seconds a render may take, and characters it may expand to,
+    # before it is stopped with an error in place of the article
+    time_limit = getattr(config, "RENDER_TIME_LIMIT", 10)
+    size_limit = getattr(config, "RENDER_SIZE_LIMIT", 4_000_000)
+    # Text shorter than this is matched without a regex timeout, which slows
+    # down every match. At this length even a pathological pattern match
+    # takes a few tens of milliseconds, and the time left is still checked
+    # before each pass.
+    timeout_min_length = 10_000
+
+    def __init__(self, article):
+        self.wiki = article.wiki
+        self.links = LinkResolver(self.wiki)
+        self.includes: dict = {}
+        self.pending_includes: set = set()
+        self.including = [article.title]
+        self.profile = RenderProfile() if RenderProfile.enabled else None
+        # Every wikilink starts with one of these
+        self.article_root_link = self.wiki.article_root_link
+        self.tag_root_link = self.wiki.tag_root_link
+        self.deadline = time.monotonic() + self.time_limit
+        # Characters of article and included text expanded so far
+        self.size = 0
+
+    @property
+    def timed_out(self):
+        return f"Article took longer than {self.time_limit} seconds to render"
+
+    def regex_budget(self, text) -> dict:
+        """
+        Keyword arguments that stop a regex call over `text`
+        when the time for this render runs out.
+        """
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise RenderBudgetExceeded(self.timed_out)
+        if not REGEX_TIMEOUTS or len(text) < self.timeout_min_length:
+            return {}
+        return {"timeout": remaining}
+
+    def expand(self, length):
+        """
+        Count `length` more characters of source text toward the size limit.
+        """
+        self.size += length
+        self.check_size(self.size)
+
+    def check_size(self, length):
+        if length > self.size_limit:
+            raise RenderBudgetExceeded(
+                f"Article is too long to render (over {self.size_limit} characters)"
+            )
+
+    def add_include(self, title):
+        if title not in self.includes:
+            self.pending_includes.add(title)
+
+    def include(self, title):
+        """
+        Content of the article included as `title`, or None if there isn't one.
+        """
+        try:
+            return self.includes[title]
+        except KeyError:
+            pass
+        self.add_include(title)
+        self.resolve_includes()
+        return self.includes[title]
+
+    def resolve_includes(self):
+        titles = list(self.pending_includes)
+        self.pending_includes.clear()
+        for index in range(0, len(titles), LinkResolver.batch_size):
+            batch = titles[index : index + LinkResolver.batch_size]
+            for title, content in (
+                Article.select(Article.title, Article.content)
+                .where(Article.wiki == self.wiki, Article.title.in_(batch))
+                .order_by(Article.id)
+                .tuples()
+            ):
+                self.includes.setdefault(title, content or "")
+            for title in batch:
+                self.includes.setdefault(title, None)
+
+        # Includes nested in these articles are looked up in the next batch
+        for title in titles:
+            for match in Article.include_re.finditer(self.includes[title] or ""):
+                self.add_include(match.group(1))
+
+
+class RenderProfile:
+    """
+    Wall time and query count for each stage of rendering one article.
+
+    Time spent in a nested stage, such as a macro inside inline formatting,
+    is not counted again in the stage around it. Everything inside a table
+    is counted as part of the table.
+    """
+
+    enabled = getattr(config, "RENDER_PROFILE", False)
+
+    stage_names = (
+        "prefetch",
+        "inline",
+        "includes",
+        "macros",
+        "tables",
+        "commonmark",
+        "links",
+        "other",
+    )
+
+    # Latest profile of each article, by wiki id and article id
+    results: dict = {}
+    results_lock = threading.Lock()
+
+    def __init__(self):
+        self.stages: dict = {}
+        self.started = time.perf_counter()
+        self.queries = db.query_count
+        self.elapsed = 0.0
+        self.query_total = 0
+        # Stage currently running, and when it last started or resumed
+        self.stack: list = [["other", self.started, self.queries]]
+
+    def _charge(self):
+        entry = self.stack[-1]
+        now, queries = time.perf_counter(), db.query_count
+        totals = self.stages.setdefault(entry[0], [0.0, 0])
+        totals[0] += now - entry[1]
+        totals[1] += queries - entry[2]
+        entry[1], entry[2] = now, queries
+
+    @contextmanager
+    def stage(self, name):
+        if self.stack[-1][0] == "tables":
+            yield
+            return
+        self._charge()
+        self.stack.append([name, time.perf_counter(), db.query_count])
+        try:
+            yield
+        finally:
+            self._charge()
+            self.stack.pop()
+            self.stack[-1][1:] = [time.perf_counter(), db.query_count]
+
+    def finish(self, article):
+        self._charge()
+        self.elapsed = time.perf_counter() - self.started
+        self.query_total = db.query_count - self.queries
+        if article.id is None:
+            return
+        self.title = article.title
+        with self.results_lock:
+            self.results.setdefault(article.wiki_id, {})[article.id] = self
+
+    @classmethod
+    def slowest(cls, wiki, count=50):
+        with cls.results_lock:
+            profiles = list(cls.results.get(wiki.id, {}).values())
+        return sorted(profiles, key=lambda profile: -profile.elapsed)[:count]
+
+    def server_timing(self):
+        """
+        The profile as the value of a Server-Timing header.
+        """
+        return ", ".join(
+            f'{name};dur={seconds * 1000:.2f};desc="{queries} queries"'
+            for name, (seconds, queries) in self.stages.items()
+        )
+
+
 class Media(BaseModel):
     wiki = ForeignKeyField(Wiki, backref="media")
     file_path = TextField()
     description = TextField(null=True)
     date_uploaded = DateTimeField(default=datetime.datetime.now)
 
+    class Meta:
+        indexes = ((("wiki", "file_path"), False),)
+
     @classmethod
     def search(cls, search_set, search_query):
         return (
@@ -1357,6 +2411,123 @@ class MediaLinks(BaseModel):
     article = ForeignKeyField(Article, backref="media_refs")
 
 
+class RenderDependency(BaseModel):
+    """
+    Something the persisted render of an article depends on, so the renders
+    a change affects are found without reading them.
+    """
+
+    article = ForeignKeyField(Article, backref="persisted_dependencies")
+    kind = CharField()
+    name = TextField()
+
+    class Meta:
+        indexes = ((("kind", "name"), False),)
+
+    @classmethod
+    def record(cls, article_id, dependencies):
+        """
+        Replace what the persisted render of an article depends on.
+        """
+        cls.delete().where(cls.article == article_id).execute()
+        rows = [(article_id, kind, str(name)) for kind, name in dependencies]
+        if rows:
+            cls.insert_many(rows, fields=(cls.article, cls.kind, cls.name)).execute()
+
+
+class Job(BaseModel):
+    """
+    A long-running operation on a wiki, carried out in the background by `jobs`.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    # Seconds between writes of a running job's progress to the database
+    PROGRESS_INTERVAL = 1.0
+
+    class Cancelled(Exception):
+        pass
+
+    kind = CharField()
+    title = TextField()
+    # Not a foreign key, so that a job can outlive the wiki it deletes
+    wiki_id = IntegerField(null=True)
+    arguments = TextField(default="{}")
+    status = CharField(default=QUEUED, index=True)
+    done = IntegerField(default=0)
+    total = IntegerField(null=True)
+    message = TextField(null=True)
+    result_link = TextField(null=True)
+    cancel_requested = BooleanField(default=False)
+    created = DateTimeField(default=datetime.datetime.now)
+    finished = DateTimeField(null=True)
+
+    @property
+    def wiki(self) -> Optional[Wiki]:
+        if self.wiki_id is None:
+            return None
+        return Wiki.get_or_none(Wiki.id == self.wiki_id)
+
+    @property
+    def link(self):
+        return f"/job/{self.id}"
+
+    @property
+    def status_link(self):
+        return f"{self.link}/status"
+
+    @property
+    def cancel_link(self):
+        return f"{self.link}/cancel"
+
+    @property
+    def ended(self) -> bool:
+        return self.status in (Job.DONE, Job.FAILED, Job.CANCELLED)
+
+    @property
+    def percent(self) -> Optional[int]:
+        if not self.total:
+            return None
+        return min(100, self.done * 100 // self.total)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "title": self.title,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "percent": self.percent,
+            "message": self.message,
+            "result_link": self.result_link,
+            "cancel_requested": self.cancel_requested,
+        }
+
+    def advance(self, count=1):
+        """
+        Record that `count` more items are done. Progress is written to the
+        database at most once every PROGRESS_INTERVAL seconds.
+        """
+        self.done += count
+        now = time.monotonic()
+        if now - getattr(self, "_progress_saved", 0) < self.PROGRESS_INTERVAL:
+            return
+        self._progress_saved = now
+        Job.update(done=self.done, total=self.total).where(Job.id == self.id).execute()
+
+    def check(self):
+        """
+        Raise Job.Cancelled if the job has been asked to stop.
+        """
+        if self.cancel_requested:
+            raise Job.Cancelled
+
+
 class ArticleIndex(FTSModel):
     rowid = RowIDField()
     content = SearchField()
@@ -0,0 +1,88 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+from data import config
+
+from cache import RenderCache
+import models
+from models import Article, Author, Wiki
+
+# Number of worker processes; defaults to one per core
+RENDER_WORKERS = getattr(config, "RENDER_WORKERS", None) or os.cpu_count() or 1
+
+# Batches smaller than this are rendered in this process,
+# as starting the workers would cost more than it saves
+RENDER_SERIAL_THRESHOLD = getattr(config, "RENDER_SERIAL_THRESHOLD", 32)
+
+# Most articles handed to a worker at once; larger chunks cost less to hand out,
+# smaller ones let a cancelled render stop sooner
+RENDER_CHUNK_SIZE = getattr(config, "RENDER_CHUNK_SIZE", 16)
+
+
+def _start_worker(link_context):
+    # Workers are forked, so they start with the parent's configuration;
+    # they get their own connection and empty render caches,
+    # and link the way the caller does. The caches are replaced, not cleared,
+    # as another thread may have held their locks when the worker forked.
+    models.open_read_only()
+    Wiki.article_cache = RenderCache(Wiki.article_cache.max_size)
+    Wiki._sidebar_cache = RenderCache(Wiki._sidebar_cache.max_size)
+    models.link_context.set(link_context)
+
+
+def _render_body(article_id):
+    article = Article.get_by_id(article_id)
+    html = article._formatted(article.content)
+    if article.render_error is not None:
+        return html, None, None
+    return html, article.autogen_metadata, sorted(article.render_dependencies)
+
+
+def _render_page(article_id, user_id):
+    from routes.decorators import article_display
+
+    article = Article.get_by_id(article_id)
+    return article_display(article.wiki, Author.get_by_id(user_id), article)
+
+
+def _results(function, *arguments):
+    """
+    Call `function` for each set of `arguments`, in worker processes
+    if there are enough of them, and yield the results in order.
+    Closing the generator early cancels the calls that haven't started.
+    """
+    count = len(arguments[0])
+    if count < RENDER_SERIAL_THRESHOLD or RENDER_WORKERS < 2:
+        for _ in zip(*arguments):
+            yield function(*_)
+        return
+
+    workers = min(RENDER_WORKERS, count)
+    chunksize = max(1, min(count // (workers * 4), RENDER_CHUNK_SIZE))
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_start_worker,
+        initargs=(models.link_context.get(),),
+    ) as executor:
+        yield from executor.map(function, *arguments, chunksize=chunksize)
+
+
+def render_articles(articles):
+    """
+    Render the saved content of each article.
+    Returns the HTML, autogenerated metadata and render dependencies for each one;
+    the metadata and dependencies are None if the render was stopped short.
+    """
+    return list(_results(_render_body, [article.id for article in articles]))
+
+
+def render_pages(articles, user):
+    """
+    Render the complete page for each article, as displayed to `user`.
+    The pages are yielded as they are ready, all by the same workers.
+    """
+    return _results(
+        _render_page, [article.id for article in articles], [user.id] * len(articles)
+    )
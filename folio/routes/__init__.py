@@ -1,9 +1,23 @@
-from bottle import default_app
+from bottle import default_app, hook, request
+
+from models import db
 
 app = default_app()
 
+
+@hook("before_request")
+def begin_request():
+    db.begin_request(read_only=request.method in ("GET", "HEAD"))
+
+
+@hook("after_request")
+def end_request():
+    db.end_request()
+
+
 from .main import *
 from .wiki import *
 from .article import *
 from .media import *
+from .job import *
 from .beta import *
@@ -499,6 +499,7 @@ def modal_edit_metadata_post(wiki: Wiki, user: Author, article: Article):
         try:
             delete_instance = article.metadata.where(Metadata.id == delete).get()
             delete_instance.delete_instance()
+            article.metadata_changed()
         except Metadata.DoesNotExist:
             pass
 
@@ -1,5 +1,5 @@
 from bottle import route
-from models import Wiki, Author
+from models import Wiki, Author, Article
 from .decorators import wiki_env
 
 
@@ -25,7 +25,10 @@ def export(wiki: Wiki) -> dict:
         {
             "wiki": shortcuts.model_to_dict(wiki, recurse=False),
             "articles": [
-                shortcuts.model_to_dict(_, recurse=False) for _ in wiki.articles
+                shortcuts.model_to_dict(
+                    _, recurse=False, exclude=[Article.rendered_content]
+                )
+                for _ in wiki.articles
             ],
             "media": [shortcuts.model_to_dict(_, recurse=False) for _ in wiki.media],
             "metadata": [
@@ -1,12 +1,13 @@
-from bottle import template, error, request, redirect
+import bottle
+from bottle import template, error, request, response, redirect, BaseTemplate
 
 from models import Article, Wiki, Author, Media, Tag, TagAssociation
 
 from utils import Error, Unsafe
 
+from hashlib import blake2b
 from math import ceil
 from urllib.parse import urlencode
-import time
 
 blank_wiki = Wiki()
 
@@ -22,22 +23,57 @@ class LocalException(Exception):
 
 
 def get_user() -> Author:
-    return Author.get(Author.name == "Admin")
+    return Author.get_by_unique(Author.name, "Admin")
 
 
 def get_wiki(wiki_title) -> Wiki:
-    while Wiki.export_mode:
-        time.sleep(0.1)
-    try:
-        wiki = Wiki.get(Wiki.title == Wiki.url_to_title(wiki_title))
-    except Wiki.DoesNotExist as e:
-        raise e
+    wiki = Wiki.get_by_title(Wiki.url_to_title(wiki_title))
 
     if wiki.sidebar_cache is None:
-        Wiki._sidebar_cache[wiki.id] = template("includes/sidebar.tpl", wiki=wiki)
+        stamp = Wiki.article_cache.stamp(wiki.id)
+        sidebar = template("includes/sidebar.tpl", wiki=wiki)
+        # A sidebar rendered while the wiki changed may already be out of date
+        if Wiki.article_cache.is_current(stamp):
+            Wiki._sidebar_cache.set(wiki.id, sidebar)
     return wiki
 
 
+def fragment(wiki: Wiki, key, source, dependencies=(), **ka):
+    """
+    Render the template named `source`, or call `source` if it is a function,
+    and cache the result for `wiki` under `key`. The result is kept until the
+    wiki, or anything in `dependencies`, changes. Each dependency is a
+    (kind, name) tuple, as for `Wiki.dependency`, and name may be left out.
+    """
+
+    def render():
+        if callable(source):
+            return source()
+        return template(source, wiki=wiki, **ka)
+
+    # Exported pages link differently
+    if wiki.id is None or wiki.export_mode:
+        return render()
+
+    cache_key = ("fragment", wiki.id, key)
+
+    def render_and_cache():
+        stamp = Wiki.article_cache.stamp(wiki.id)
+        result = render()
+        Wiki.article_cache.set(
+            cache_key,
+            result,
+            [wiki.dependency("wiki")] + [wiki.dependency(*_) for _ in dependencies],
+            stamp,
+        )
+        return result
+
+    return Wiki.article_cache.get_or_render(cache_key, render_and_cache)
+
+
+BaseTemplate.defaults["fragment"] = fragment
+
+
 def user_env(func):
     def wrapper(*a, **ka):
         user = get_user()
@@ -108,6 +144,8 @@ def error_404(error):
 
 
 def home_page_render(wikis=None, messages=[]):
+    if wikis is not None:
+        wikis = Wiki.prefetch_metadata(wikis, ("cover_img",))
     return template(
         "home.tpl",
         wikis=wikis,
@@ -170,12 +208,67 @@ def paginator(media: Media):
     return media, pagination
 
 
+def article_column_requested() -> bool:
+    """
+    Whether the request is for only the article column and title of a page,
+    as used by in-wiki navigation, rather than the whole page.
+    """
+    return (
+        request.get_header("X-Fragment") == "article"
+        or request.query.get("fragment") == "article"
+    )
+
+
+def etag_for(content: str) -> str:
+    return f'"{blake2b(content.encode("utf-8"), digest_size=16).hexdigest()}"'
+
+
+def not_modified(etag: str) -> bool:
+    """
+    Whether the client already has the version of a response identified by `etag`,
+    according to the request's If-None-Match header.
+    """
+    match = request.get_header("If-None-Match")
+    if match is None:
+        return False
+    if match.strip() == "*":
+        return True
+    return etag in (_.strip().removeprefix("W/") for _ in match.split(","))
+
+
 def article_display(wiki: Wiki, user: Author, article: Article):
-    try:
-        return Wiki.article_cache[article.id]
-    except KeyError:
-        pass
+    if wiki.export_mode:
+        return _article_page(wiki, user, article)
 
+    column_only = article_column_requested()
+    response.set_header("Vary", "X-Fragment")
+    if article.id is None:
+        return _article_page(wiki, user, article, column_only=column_only)
+
+    etag, page = Wiki.article_cache.get_or_render(
+        ("page", article.id, column_only),
+        lambda: _article_page(wiki, user, article, True, column_only),
+    )
+    # Clients may keep the page, but must check that it is still current
+    response.set_header("ETag", etag)
+    response.set_header("Cache-Control", "no-cache")
+    if not_modified(etag):
+        response.status = 304
+        return ""
+    return page
+
+
+def _article_page(
+    wiki: Wiki, user: Author, article: Article, cacheable=False, column_only=False
+):
+    """
+    Render the page for `article`. If it is `cacheable`, the page is cached
+    and returned along with its ETag.
+    """
+    stamp = Wiki.article_cache.stamp(wiki.id)
+
+    # Both are looked up for every page, so they are fetched together
+    Article.prefetch_metadata([article], ("@redirect", "@hide-title"))
     redirect_article = article.get_metadata("@redirect")
     if redirect_article:
         try:
@@ -185,7 +278,7 @@ def article_display(wiki: Wiki, user: Author, article: Article):
         except Article.DoesNotExist:
             pass
         else:
-            if not Wiki.export_mode:
+            if not wiki.export_mode:
                 return redirect(article.link)
 
     if article.id is None:
@@ -219,15 +312,28 @@ def article_display(wiki: Wiki, user: Author, article: Article):
 
         article.content = f'This article does not exist. Click the <a class="autogenerate" href="{article.edit_link}">edit link</a> to create this article.{forms_txt_list}'
 
+    style_dependencies: set = set()
+
     result = template(
-        "article.tpl",
+        "article_column.tpl" if column_only else "article.tpl",
         articles=[article],
         page_title=f"{article.title} ({wiki.title})",
         wiki=wiki,
-        style=wiki.stylesheet(),
+        style=wiki.stylesheet(style_dependencies),
     )
 
-    if article.id:
-        Wiki.article_cache[article.id] = result
+    profile = getattr(article, "render_profile", None)
+    # Exports may be rendered outside of any request
+    if bottle.DEBUG and profile is not None and not wiki.export_mode:
+        response.set_header("Server-Timing", profile.server_timing())
+
+    if cacheable:
+        result = etag_for(result), result
+        Wiki.article_cache.set(
+            ("page", article.id, column_only),
+            result,
+            article.page_dependencies | style_dependencies,
+            stamp,
+        )
 
     return result
@@ -0,0 +1,48 @@
+from bottle import template, route, redirect
+
+from models import Job, Wiki
+
+from .decorators import home_page_render, blank_wiki
+
+from utils import Error
+
+import jobs
+import json
+
+
+def job_env(func):
+    def wrapper(job_id: int):
+        try:
+            job = jobs.get(job_id)
+        except Job.DoesNotExist:
+            return home_page_render(
+                Wiki.select().order_by(Wiki.title.asc()),
+                [Error(f"Job {job_id} not found.")],
+            )
+        return func(job)
+
+    return wrapper
+
+
+@route("/job/<job_id:int>")
+@job_env
+def job_page(job: Job):
+    return template(
+        "job.tpl",
+        job=job,
+        wiki=job.wiki or blank_wiki,
+        page_title=job.title,
+    )
+
+
+@route("/job/<job_id:int>/status")
+@job_env
+def job_status(job: Job):
+    return json.dumps(job.as_dict())
+
+
+@route("/job/<job_id:int>/cancel", method="POST")
+@job_env
+def job_cancel(job: Job):
+    jobs.cancel(job.id)
+    return redirect(job.link)
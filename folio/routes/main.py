@@ -38,6 +38,7 @@ def get_titles(title=None):
     wikis = Wiki.select().order_by(Wiki.title.asc())
     if title:
         wikis = wikis.where(Wiki.title.contains(title))
+    wikis = Wiki.prefetch_metadata(wikis, ("cover_img",))
     return template("includes/wiki_listing.tpl", wikis=wikis)
 
 
@@ -4,6 +4,7 @@ from bottle import (
     static_file,
     request,
     HTTPError,
+    HTTPResponse,
 )
 
 
@@ -19,6 +20,7 @@ from .decorators import *
 # from __main__ import config
 from data import config
 from utils import Message, Error, Unsafe
+from compression import accepts_gzip
 
 from peewee import SQL
 
@@ -26,6 +28,7 @@ from pathlib import Path
 from typing import Union
 
 import json
+import os
 
 
 @route("/static/<filename>")
@@ -33,6 +36,31 @@ def static_content(filename: str):
     return static_file(filename, "folio/static")
 
 
+# Fingerprinted files never change, so they can be kept for a year
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@route("/static/<fingerprint>/<filename>")
+def static_asset(fingerprint: str, filename: str):
+    assets = Wiki.static_assets
+    compressed = assets.compressed(filename) if accepts_gzip(request.environ) else None
+    if compressed is None:
+        result = static_file(filename, str(assets.path))
+    else:
+        result = static_file(
+            compressed.name, str(compressed.parent), assets.mimetype(filename)
+        )
+
+    if result.status_code in (200, 206, 304):
+        if compressed is not None:
+            result.set_header("Content-Encoding", "gzip")
+        result.set_header("Vary", "Accept-Encoding")
+        # Links to an earlier version of the files get the current ones
+        if fingerprint == assets.fingerprint:
+            result.set_header("Cache-Control", STATIC_CACHE_CONTROL)
+    return result
+
+
 @route(f"{Wiki.PATH}/media")
 @wiki_env
 def wiki_media(wiki: Wiki, user: Author):
@@ -83,10 +111,22 @@ def wiki_media_paste(wiki: Wiki, user: Author):
 @route(f"{Wiki.PATH}/media/<file_name>")
 @wiki_env
 def media_file(wiki: Wiki, user: Author, file_name: str):
-    return static_file(
-        Wiki.url_to_file(file_name),
-        f"{config.DATA_PATH}/{wiki.id}",
-    )
+    file_name = Wiki.url_to_file(file_name)
+    root = f"{config.DATA_PATH}/{wiki.id}"
+    try:
+        stats = os.stat(Path(root, file_name))
+    except OSError:
+        return static_file(file_name, root)
+
+    # Replacing a file changes its modification time, so clients always revalidate
+    etag = f'"{stats.st_mtime_ns:x}-{stats.st_size:x}"'
+    if not_modified(etag):
+        result = HTTPResponse(status=304)
+    else:
+        result = static_file(file_name, root)
+    result.set_header("ETag", etag)
+    result.set_header("Cache-Control", "no-cache")
+    return result
 
 
 @route(f"{Wiki.PATH}/media/<media_filename>/edit")
@@ -13,9 +13,14 @@ from models import (
     Author,
     Tag,
     Media,
+    RenderProfile,
+    Job,
+    export_links,
 )
 
-from .decorators import wiki_env, article_display, home_page_render
+from .decorators import wiki_env, article_display, home_page_render, fragment
+from render_pool import render_articles, render_pages
+import jobs
 
 # from __main__ import config
 from data import config
@@ -23,6 +28,7 @@ from utils import Message, Error, Unsafe
 
 from peewee import SQL
 
+from contextlib import closing
 from pathlib import Path
 from typing import Any
 
@@ -36,9 +42,19 @@ def wiki_home(wiki: Wiki, user: Author):
     return article_display(wiki, user, wiki.main_article)
 
 
-@route(f"{Wiki.PATH}/export")
+@route(f"{Wiki.PATH}/export-static")
 @wiki_env
 def wiki_export(wiki: Wiki, user: Author):
+    job = jobs.enqueue("export", f"Export {wiki.title}", wiki, user_id=user.id)
+    return redirect(job.link)
+
+
+# Articles rendered between checks for cancellation during an export
+EXPORT_BATCH_SIZE = getattr(config, "EXPORT_BATCH_SIZE", 100)
+
+
+@jobs.handler("export")
+def export_wiki(job: Job, wiki: Wiki, user_id: int):
     import os, glob, shutil
 
     export_path = Path(config.DATA_PATH, "export", wiki.title_to_url(wiki.title))
@@ -63,25 +79,25 @@ def wiki_export(wiki: Wiki, user: Author):
     for m in wiki.media:
         shutil.copy(m.file_path_, media_path)
 
-    # TODO: make a context mgr
-
-    wiki.invalidate_cache()
-
-    Wiki.export_mode = True
-
-    for article in wiki.articles_nondraft_only:
-        article_text = article_display(wiki, user, article)
-
-        with open(
-            Path(article_path, f"{wiki.title_to_url(article.title)}.html"),
-            "w",
-            encoding="utf-8",
-        ) as export_file:
-            export_file.write(article_text)
-
-    Wiki.export_mode = False
-
-    wiki.invalidate_cache()
+    user = Author.get_by_id(user_id)
+    articles = list(wiki.articles_nondraft_only)
+    job.total = len(articles)
+
+    # Exported pages bypass the caches, so live requests are unaffected.
+    # They all come from one set of workers, and closing them on cancellation
+    # stops the renders not yet started.
+    with export_links(), closing(render_pages(articles, user)) as pages:
+        for start in range(0, len(articles), EXPORT_BATCH_SIZE):
+            job.check()
+            batch = articles[start : start + EXPORT_BATCH_SIZE]
+            for article, article_text in zip(batch, pages):
+                with open(
+                    Path(article_path, f"{wiki.title_to_url(article.title)}.html"),
+                    "w",
+                    encoding="utf-8",
+                ) as export_file:
+                    export_file.write(article_text)
+            job.advance(len(batch))
 
     with open(Path(article_path, ".htaccess"), "w", encoding="utf8") as htf:
         htf.write("DirectoryIndex Contents.html")
@@ -101,7 +117,8 @@ def wiki_export(wiki: Wiki, user: Author):
     with open(Path(export_path, "index.html"), "w", encoding="utf8") as rdf:
         rdf.write(redirect_txt)
 
-    return "ok"
+    job.message = f"Exported {len(articles)} articles to {export_path}."
+    job.result_link = wiki.link
 
 
 @route(f"{Wiki.PATH}/edit", method=("GET", "POST"))
@@ -164,13 +181,31 @@ def clone_wiki(wiki: Wiki, user: Author):
 @route(f"{Wiki.PATH}/clone", method="POST")
 @wiki_env
 def clone_wiki_confirm(wiki: Wiki, user: Author):
+    job = jobs.enqueue(
+        "clone", f"Create a new wiki from {wiki.title}", wiki, user_id=user.id
+    )
+    return redirect(job.link)
+
+
+@jobs.handler("clone")
+def clone_wiki_job(job: Job, wiki: Wiki, user_id: int):
+    user = Author.get_by_id(user_id)
+    template_articles = list(wiki.template)
+    job.total = len(template_articles)
+
     new_wiki = Wiki.new_wiki(
         f"New wiki created from {wiki.title}", "", user, empty=True
     )
 
     # TODO: move to models
 
-    for article in wiki.template:
+    new_articles = []
+
+    for article in template_articles:
+        if job.cancel_requested:
+            new_wiki.delete_()
+            job.check()
+
         if article.has_tag("@asis") or article.has_tag("@form"):
             # copy article text
             article_content = article.content
@@ -189,15 +224,33 @@ def clone_wiki_confirm(wiki: Wiki, user: Author):
 
         # FIXME: I thought article.tags gave us tags, not associations
 
-        for tag in article.tags:
+        # Read in full first, as another job may write while a cursor is open
+        for tag in list(article.tags):
             new_article.add_tag(tag.tag.title)
 
-        for metadata in article.metadata_not_autogen:
+        for metadata in list(article.metadata_not_autogen):
             new_article.set_metadata(metadata.key, metadata.value)
 
         new_article.update_index()
-        new_article.update_links()
-        new_article.update_autogen_metadata()
+        new_articles.append((article, new_article))
+        job.advance()
+
+    # Render once every article exists, so links between them resolve
+
+    stamp = Wiki.article_cache.stamp(new_wiki.id)
+    renders = render_articles([new_article for _, new_article in new_articles])
+
+    # Stored before updating any metadata, which would make the stamp stale
+    for (_, new_article), (html, _, dependencies) in zip(new_articles, renders):
+        new_article.store_render(html, dependencies, stamp)
+
+    for (article, new_article), (html, metadata, dependencies) in zip(
+        new_articles, renders
+    ):
+        # Renders that were stopped short leave links and metadata as they were
+        if dependencies is not None:
+            new_article.update_links(html)
+            new_article.update_autogen_metadata(metadata)
 
         if article.has_tag("@form"):
             make_auto = new_article.get_metadata("@make-auto")
@@ -211,7 +264,8 @@ def clone_wiki_confirm(wiki: Wiki, user: Author):
 
     new_wiki.invalidate_cache()
 
-    return redirect(new_wiki.edit_link)
+    job.message = f'Created "{new_wiki.title}" with {len(new_articles)} articles.'
+    job.result_link = new_wiki.edit_link
 
 
 @route(f"{Wiki.PATH}/delete")
@@ -238,10 +292,16 @@ def wiki_delete(wiki: Wiki, user: Author):
 @route(f"{Wiki.PATH}/delete/<delete_key>")
 @wiki_env
 def wiki_delete_confirm(wiki: Wiki, user: Author, delete_key: str):
+    job = jobs.enqueue("delete", f"Delete {wiki.title}", wiki)
+    return redirect(job.link)
+
+
+@jobs.handler("delete")
+def wiki_delete_job(job: Job, wiki: Wiki):
     wiki_title = wiki.title
-    wiki.delete_()
-    confirmation = f'Wiki "{Unsafe(wiki_title)}" has been deleted.'
-    return home_page_render([Message(confirmation)])
+    wiki.delete_(job)
+    job.message = f'Wiki "{wiki_title}" has been deleted.'
+    job.result_link = "/"
 
 
 @route(f"{Wiki.PATH}/new", method=("GET", "POST"))
@@ -333,29 +393,14 @@ def wiki_replace(wiki: Wiki, user: Author):
             ]
 
         if replace_query and request.forms.get("replace", ""):
-            for result in search_results:
-                result.make_revision()
-                result.content = result.content.replace(search_query, replace_query)
-                result.last_edited = datetime.datetime.now()
-                result.save()
-                result.update_index()
-                result.update_links()
-                result.update_autogen_metadata()
-            wiki.invalidate_cache()
-
-            search_results = (
-                wiki.articles.select()
-                .where(
-                    Article.revision_of.is_null(),
-                    Article.content.contains(replace_query),
-                )
-                .order_by(SQL("title COLLATE NOCASE"))
+            job = jobs.enqueue(
+                "replace",
+                f"Replace all in {wiki.title}",
+                wiki,
+                search_query=search_query,
+                replace_query=replace_query,
             )
-            results = search_results
-            result_query = replace_query
-
-            article_count = search_results.count()
-            messages = [Message(f"{article_count} articles updated.", "success")]
+            return redirect(job.link)
 
     return template(
         "wiki_replace.tpl",
@@ -370,6 +415,77 @@ def wiki_replace(wiki: Wiki, user: Author):
     )
 
 
+@jobs.handler("replace")
+def wiki_replace_job(job: Job, wiki: Wiki, search_query: str, replace_query: str):
+    search_results = list(
+        wiki.articles.select()
+        .where(
+            Article.revision_of.is_null(),
+            Article.content.contains(search_query),
+        )
+        .order_by(SQL("title COLLATE NOCASE"))
+    )
+    job.total = len(search_results)
+
+    updated = []
+    for result in search_results:
+        # Stopping here still renders whatever was already replaced
+        if job.cancel_requested:
+            break
+        updated.append(result.make_revision(update=False))
+        result.content = result.content.replace(search_query, replace_query)
+        result.last_edited = datetime.datetime.now()
+        result.save()
+        result.update_index()
+        updated.append(result)
+        job.advance()
+
+    stamp = Wiki.article_cache.stamp(wiki.id)
+    renders = render_articles(updated)
+
+    # Stored before updating any metadata, which would make the stamp stale
+    for article, (html, _, dependencies) in zip(updated, renders):
+        article.store_render(html, dependencies, stamp)
+
+    for article, (html, metadata, dependencies) in zip(updated, renders):
+        if dependencies is not None:
+            article.update_links(html)
+            article.update_autogen_metadata(metadata)
+    wiki.invalidate_cache()
+
+    if job.cancel_requested:
+        raise Job.Cancelled(
+            f"Cancelled after {job.done} of {job.total} articles were updated."
+        )
+    job.message = f"{job.done} articles updated."
+    job.result_link = f"{wiki.link}/replace"
+
+
+@route(f"{Wiki.PATH}/reindex")
+@wiki_env
+def wiki_reindex(wiki: Wiki, user: Author):
+    job = jobs.enqueue("reindex", f"Reindex {wiki.title}", wiki)
+    return redirect(job.link)
+
+
+@jobs.handler("reindex")
+def wiki_reindex_job(job: Job, wiki: Wiki):
+    """
+    Rebuild the search index and stored render of every article in the wiki.
+    """
+    articles = list(wiki.articles.where(Article.content.is_null(False)))
+    job.total = len(articles)
+    for article in articles:
+        job.check()
+        article.update_index()
+        article.rerender()
+        job.advance()
+    wiki.invalidate_cache()
+
+    job.message = f"Reindexed {len(articles)} articles."
+    job.result_link = wiki.link
+
+
 @route(f"{Wiki.PATH}/search2", method=("POST",))
 @wiki_env
 def wiki_search2(wiki: Wiki, user: Author):
@@ -462,6 +578,72 @@ def tags_all(wiki: Wiki, user: Author):
     return template("wiki_tags.tpl", tags=wiki.tags_alpha, wiki=wiki)
 
 
+@route(f"{Wiki.PATH}/render-profile")
+@wiki_env
+def render_profile(wiki: Wiki, user: Author):
+    messages = []
+    if not RenderProfile.enabled:
+        messages.append(
+            Message(
+                "Render profiling is off. Set <code>RENDER_PROFILE = True</code> in the config file and restart to turn it on."
+            )
+        )
+    return template(
+        "wiki_render_profile.tpl",
+        profiles=RenderProfile.slowest(wiki),
+        stages=RenderProfile.stage_names,
+        caches=(
+            ("Article renders", Wiki.article_cache.stats()),
+            ("Sidebars", Wiki._sidebar_cache.stats()),
+        ),
+        page_title=f"Render performance ({wiki.title})",
+        wiki=wiki,
+        messages=messages,
+    )
+
+
+# Number of items in each page of a sidebar list
+SIDEBAR_PAGE_SIZE = getattr(config, "SIDEBAR_PAGE_SIZE", 250)
+
+# Template and query for each sidebar list that is loaded when its tab is opened
+sidebar_lists = {
+    "articles": ("includes/all_article_list.tpl", "articles_nondraft_only"),
+    "drafts": ("includes/draft_article_list.tpl", "articles_draft_only"),
+    "uncreated": ("includes/uncreated_article_list.tpl", "uncreated_articles"),
+    "tags": ("includes/wiki_tag_list.tpl", "tags_alpha"),
+}
+
+
+@route(f"{Wiki.PATH}/sidebar/<list_name:re:{'|'.join(sidebar_lists)}>")
+@wiki_env
+def sidebar_list(wiki: Wiki, user: Author, list_name: str):
+    list_template, query = sidebar_lists[list_name]
+    try:
+        page = max(int(request.query.get("p", 1)), 1)
+    except ValueError:
+        page = 1
+
+    def render():
+        items = list(
+            getattr(wiki, query)
+            .offset((page - 1) * SIDEBAR_PAGE_SIZE)
+            .limit(SIDEBAR_PAGE_SIZE + 1)
+        )
+        more_link = None
+        if len(items) > SIDEBAR_PAGE_SIZE:
+            items.pop()
+            more_link = f"{wiki.sidebar_link}/{list_name}?p={page + 1}"
+        return template(
+            list_template,
+            wiki=wiki,
+            items=items,
+            more_link=more_link,
+            jsnavlink='class="jsnavlink"',
+        )
+
+    return fragment(wiki, ("sidebar", list_name, page), render, [("sidebar",)])
+
+
 @route(f"{Wiki.PATH}/upload", method="POST")
 @wiki_env
 def upload_to_wiki(wiki: Wiki, user: Author):
@@ -4,7 +4,12 @@ defaults = {
     "Save pasted images as": ("JPEG", "PNG"),
 }
 
-DB_SCHEMA = 0
+# Bump this along with a new migration in migrations.py
+DB_SCHEMA = 3
+
+# Bump this whenever a change to the renderer alters its output,
+# so renders persisted by older versions are discarded.
+RENDER_VERSION = 3
 
 PRODUCT_NAME = "Folio"
 
@@ -14,10 +14,20 @@ $(window).on("keydown", function (e) {
 });
 
 function setArticle(data){
-    new_ = $(data).find("#article-col")[0];
+    // Article pages send only the title and article column, other pages send everything
+    data = $(data);
+    new_ = data.filter("#article-col").add(data.find("#article-col"))[0];
     $("#article-col").replaceWith(new_);
-    console.log($(data).filter("title"));
-    document.title = $(data).filter("title").text();
+    document.title = data.filter("title").text();
+}
+
+function getArticle(href, success){
+    $.ajax({
+        type: "GET",
+        url: href,
+        headers: {"X-Fragment": "article"},
+        success: success
+    });
 }
 
 function activateSidebarLinks(){
@@ -25,14 +35,10 @@ function activateSidebarLinks(){
     $('.jsnavlink').on('click', function(e) {
         e.preventDefault();
         href = this.href
-        $.ajax({
-            type: "GET",
-            url: href,
-            success: function(data){
-                window.history.pushState({url: window.href}, null, href);
-                setArticle(data);    
-            }
-        });   
+        getArticle(href, function(data){
+            window.history.pushState({url: window.href}, null, href);
+            setArticle(data);
+        });
     });
 }
 
@@ -41,13 +47,7 @@ window.addEventListener("popstate", function(e) {
     if (e.state != null) {
         e.preventDefault();
         href = e.state.url;
-        $.ajax({
-            type: "GET",
-            url: href,
-            success: function(data){
-                setArticle(data);    
-            }
-        });    
+        getArticle(href, setArticle);
     } else
     {
         window.location.href = window.location.href;
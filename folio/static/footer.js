@@ -184,4 +184,34 @@ $('#wiki-search-input').on("keyup", function(e) {
     });
 });
 
-$('#wiki-search-input').focus();
\ No newline at end of file
+$('#wiki-search-input').focus();
+
+function loadSidebarList(list, url) {
+    $.ajax({
+        type: "GET",
+        url: url,
+        success: function(data) {
+            list.find(".sidebar-more").remove();
+            list.append(data);
+            list.find(".sidebar-more a").on("click", function(e) {
+                e.preventDefault();
+                loadSidebarList(list, this.href);
+            });
+            if (typeof activateSidebarLinks === "function") {
+                activateSidebarLinks();
+            }
+        }
+    });
+}
+
+// Sidebar lists are loaded the first time their tab is opened
+$('.wiki-sidebar-controls a[data-toggle="tab"]').on("shown.bs.tab", function(e) {
+    $($(e.target).attr("href")).find("[data-src]").each(function() {
+        var list = $(this);
+        if (list.data("loaded") || !list.closest(".tab-pane").hasClass("active")) {
+            return;
+        }
+        list.data("loaded", true);
+        loadSidebarList(list, list.data("src"));
+    });
+});
@@ -3,13 +3,7 @@
 <main role="main" class="container-wiki">
 
   <div id="article-row" class="row">
-    <div id="article-col" class="col">
-      % include('includes/messages.tpl')
-      % for article in articles:
-      % include('includes/article_core.tpl')
-      <hr style="clear: both;">
-      % end
-    </div>
+    % include('includes/article_col.tpl')
     <div id="sidebar" class="sidebar-col">
       % include('includes/sidebar.tpl')
     </div>
@@ -19,4 +13,4 @@
 
 % include('includes/footer.tpl')
 
-<script src="{{wiki.static_folder_link}}/article.js?0.0.6"></script>
+<script src="{{wiki.static_folder_link}}/article.js"></script>
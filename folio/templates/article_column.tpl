@@ -0,0 +1,2 @@
+<title>{{page_title if "page_title" in locals() else wiki.title}}</title>
+% include('includes/article_col.tpl')
@@ -136,4 +136,4 @@
     hasError = {{ has_error }};
     mediaPaste = "{{ wiki.media_paste_link }}";
 </script>
-<script src="/static/editor.js?0.0.6"></script>
\ No newline at end of file
+<script src="{{wiki.static_folder_link}}/editor.js"></script>
\ No newline at end of file
@@ -1,3 +1,4 @@
-% for _ in wiki.articles_nondraft_only:
+% for _ in items:
 <li><a {{!jsnavlink}} href="{{_.link}}">{{_.title}}</a></li>
-% end
\ No newline at end of file
+% end
+% include('includes/sidebar_more.tpl')
\ No newline at end of file
@@ -0,0 +1,7 @@
+    <div id="article-col" class="col">
+      % include('includes/messages.tpl')
+      % for article in articles:
+      % include('includes/article_core.tpl')
+      <hr style="clear: both;">
+      % end
+    </div>
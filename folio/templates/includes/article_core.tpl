@@ -32,21 +32,11 @@
 </div>
 % end
 
-<div class="wiki-tags">
-  % if article.exists_as_tag:
-  <a title="This page is also a tag; see all articles with this tag" href="{{article.exists_as_tag.link}}"><span class="badge badge-secondary">{{article.exists_as_tag.title}}</span></a>
-  % end
-  % for tag_ref in article.tags_alpha:
-    % tag_article = tag_ref.article_exists
-    % if tag_article:
-    <a title="See article with this tag name" href="{{tag_article.link}}"><span class="badge badge-success">{{tag_article.title}}</span></a>
-    % elif tag_ref.is_system_tag:
-    <a title="See all articles with this system tag" href="{{tag_ref.link}}"><span class="badge badge-danger">{{tag_ref.title}}</span></a>
-    % else:
-    <a title="See all articles with this tag" href="{{tag_ref.link}}"><span class="badge badge-primary">{{tag_ref.title}}</span></a>
-    % end
-  % end
-</div>
+% if article.id:
+{{!fragment(article.wiki, ("tags", article.id), "includes/article_tags.tpl", [("id", article.id), ("tag", article.title), ("sidebar",)], article=article)}}
+% else:
+% include('includes/article_tags.tpl')
+% end
 <small><b>{{article.author.name if article.author else ''}}</b> {{article.formatted_date}}</small>
 <hr />
 
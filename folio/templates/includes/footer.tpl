@@ -8,4 +8,4 @@
     media_path = "{{wiki.media_link}}";
     search_endpoint = "{{wiki.search_endpoint}}";
 </script>
-<script src="{{wiki.static_folder_link}}/footer.js?{{wiki.settings.PRODUCT_VERSION}}"></script>
+<script src="{{wiki.static_folder_link}}/footer.js"></script>
@@ -58,7 +58,7 @@
     <div class="tab-content">
         <div class="tab-pane active" id="history" role="tabpanel" aria-labelledby="tab_history">
             <div class="wiki-recent-list">
-                % include('includes/recent_article_list.tpl')
+                {{!fragment(wiki, "recent", "includes/recent_article_list.tpl", [("sidebar",)], jsnavlink=jsnavlink)}}
             </div>
         </div>
         <div class="tab-pane" id="articles" role="tabpanel" aria-labelledby="tab_articles">
@@ -81,27 +81,43 @@
             </ul>
             <div class="tab-content">
                 <div class="tab-pane active" id="all-articles" role="tabpanel" aria-labelledby="all-articles">
+                    % if wiki.export_mode:
                     <div class="wiki-all-articles">
-                        % include('includes/all_article_list.tpl')
+                        % include('includes/all_article_list.tpl', items=wiki.articles_nondraft_only)
                     </div>
+                    % else:
+                    <div class="wiki-all-articles" data-src="{{wiki.sidebar_link}}/articles"></div>
+                    % end
                 </div>
                 <div class="tab-pane" id="articles-drafts" role="tabpanel" aria-labelledby="articles-drafts">
+                    % if wiki.export_mode:
                     <div class="wiki-draft-articles">
-                        % include('includes/draft_article_list.tpl')
+                        % include('includes/draft_article_list.tpl', items=wiki.articles_draft_only)
                     </div>
+                    % else:
+                    <div class="wiki-draft-articles" data-src="{{wiki.sidebar_link}}/drafts"></div>
+                    % end
                 </div>
                 <div class="tab-pane" id="articles-uncreated" role="tabpanel" aria-labelledby="articles-uncreated">
+                    % if wiki.export_mode:
                     <div class="wiki-uncreated-articles">
-                        % include('includes/uncreated_article_list.tpl')
+                        % include('includes/uncreated_article_list.tpl', items=wiki.uncreated_articles)
                     </div>
+                    % else:
+                    <div class="wiki-uncreated-articles" data-src="{{wiki.sidebar_link}}/uncreated"></div>
+                    % end
                 </div>
             </div>
 
         </div>
         <div class="tab-pane" id="tags" role="tabpanel" aria-labelledby="tag_tags">
+            % if wiki.export_mode:
             <div class="wiki-tag-items">
-                % include('includes/wiki_tag_list.tpl')
+                % include('includes/wiki_tag_list.tpl', items=wiki.tags_alpha)
             </div>
+            % else:
+            <div class="wiki-tag-items" data-src="{{wiki.sidebar_link}}/tags"></div>
+            % end
         </div>
     </div>
 
@@ -0,0 +1,3 @@
+% if get("more_link"):
+<li class="sidebar-more"><a href="{{more_link}}">More…</a></li>
+% end
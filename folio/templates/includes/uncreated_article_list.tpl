@@ -1,3 +1,4 @@
-% for _ in wiki.uncreated_articles:
+% for _ in items:
 <li><a {{!jsnavlink}} href="{{wiki.article_root_link}}/{{_.link}}">{{_.link}}</a></li>
-% end
\ No newline at end of file
+% end
+% include('includes/sidebar_more.tpl')
\ No newline at end of file
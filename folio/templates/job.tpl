@@ -0,0 +1,59 @@
+% include('includes/header.tpl')
+
+<main role="main" class="container-wiki">
+
+    % include('includes/messages.tpl')
+
+    <h1>{{job.title}}</h1>
+
+    <hr />
+
+    <div class="progress mb-3">
+        <div id="job-progress" class="progress-bar{{'' if job.ended else ' progress-bar-striped progress-bar-animated'}}"
+            role="progressbar" style="width: {{job.percent if job.percent is not None else 100}}%"></div>
+    </div>
+
+    <p>
+        <b id="job-status">{{job.status.capitalize()}}</b>
+        <span id="job-count">{{f"({job.done} of {job.total})" if job.total else ""}}</span>
+        <span id="job-message">{{job.message or ""}}</span>
+    </p>
+
+    <hr />
+
+    % if not job.ended:
+    <form method="POST" action="{{job.cancel_link}}">
+        <button type="submit" class="btn btn-sm btn-warning" {{'disabled' if job.cancel_requested else ''}}>
+            Cancel</button>
+    </form>
+    <script>
+        function pollJob() {
+            fetch("{{job.status_link}}").then(response => response.json()).then(job => {
+                if (["done", "failed", "cancelled"].includes(job.status)) {
+                    window.location.reload();
+                    return;
+                }
+                if (job.percent !== null) {
+                    document.getElementById("job-progress").style.width = job.percent + "%";
+                    document.getElementById("job-count").innerText = "(" + job.done + " of " + job.total + ")";
+                }
+                document.getElementById("job-status").innerText = job.status.charAt(0).toUpperCase() + job.status.slice(1);
+                setTimeout(pollJob, 1000);
+            });
+        }
+        setTimeout(pollJob, 1000);
+    </script>
+    % elif job.result_link and job.status == "done":
+    <a href="{{job.result_link}}">
+        <button type="button" class="btn btn-sm btn-success">Continue</button>
+    </a>
+    % elif wiki.id:
+    <a href="{{wiki.link}}">
+        <button type="button" class="btn btn-sm btn-primary">Return to {{wiki.title}}</button>
+    </a>
+    % end
+
+</main>
+
+</body>
+</html>
@@ -53,6 +53,19 @@
                             wiki using this one as a template</button>
                     </a>
 
+                    <a href="{{original_wiki.render_profile_link}}">
+                        <button type="button" class="btn btn-sm btn-secondary">See render performance</button>
+                    </a>
+
+                    <a href="{{original_wiki.link}}/reindex">
+                        <button type="button" class="btn btn-sm btn-secondary">Rebuild search index and
+                            renders</button>
+                    </a>
+
+                    <a href="{{original_wiki.link}}/export-static">
+                        <button type="button" class="btn btn-sm btn-secondary">Export as a static site</button>
+                    </a>
+
 
                     <hr />
 
@@ -0,0 +1,77 @@
+% include('includes/header.tpl')
+
+<main role="main" class="container-wiki">
+
+  <div id="article-row" class="row">
+    <div id="article-col" class="col">
+      % include('includes/messages.tpl')
+      <h2>Render performance</h2>
+      <h3>Slowest articles</h3>
+      <p>Time in milliseconds and number of queries for each stage of the most recent render of each article since the server started.</p>
+      % if profiles:
+      <table class="table table-striped table-bordered table-hover table-sm">
+        <thead class="thead-light">
+          <tr>
+            <th>Article</th>
+            <th>Total</th>
+            % for stage in stages:
+            <th>{{stage}}</th>
+            % end
+          </tr>
+        </thead>
+        <tbody>
+          % for profile in profiles:
+          <tr>
+            <td><a href="{{wiki.article_root_link}}/{{wiki.title_to_url(profile.title)}}">{{profile.title}}</a></td>
+            <td>{{f"{profile.elapsed * 1000:.1f}"}} / {{profile.query_total}}</td>
+            % for stage in stages:
+            % seconds, queries = profile.stages.get(stage, (0.0, 0))
+            <td>{{f"{seconds * 1000:.1f}"}} / {{queries}}</td>
+            % end
+          </tr>
+          % end
+        </tbody>
+      </table>
+      % else:
+      <p>No articles have been rendered yet.</p>
+      % end
+      <h3>Caches</h3>
+      <p>Shared by every wiki on this server.</p>
+      <table class="table table-striped table-bordered table-hover table-sm">
+        <thead class="thead-light">
+          <tr>
+            <th>Cache</th>
+            <th>Entries</th>
+            <th>Size (KB)</th>
+            <th>Limit (KB)</th>
+            <th>Hits</th>
+            <th>Misses</th>
+            <th>Evictions</th>
+          </tr>
+        </thead>
+        <tbody>
+          % for name, stats in caches:
+          <tr>
+            <td>{{name}}</td>
+            <td>{{stats["entries"]}}</td>
+            <td>{{stats["size"] // 1024}}</td>
+            <td>{{stats["max_size"] // 1024 if stats["max_size"] is not None else "None"}}</td>
+            <td>{{stats["hits"]}}</td>
+            <td>{{stats["misses"]}}</td>
+            <td>{{stats["evictions"]}}</td>
+          </tr>
+          % end
+        </tbody>
+      </table>
+      <hr />
+    </div>
+
+    <div id="sidebar" class="sidebar-col">
+      % include('includes/sidebar.tpl')
+      <hr />
+    </div>
+  </div>
+
+</main>
+
+% include('includes/footer.tpl')
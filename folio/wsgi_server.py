@@ -0,0 +1,317 @@
+from collections import deque
+from queue import Queue, Full
+import selectors
+import socket
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import (
+    ServerHandler,
+    WSGIRequestHandler,
+    WSGIServer,
+    make_server as make_wsgi_server,
+)
+import threading
+import time
+
+from data import config
+
+# "pooled" serves requests from a fixed set of worker threads;
+# "threaded" starts a new thread for every connection
+SERVER_MODE = getattr(config, "SERVER_MODE", "pooled")
+
+# Number of worker threads in pooled mode
+SERVER_WORKERS = getattr(config, "SERVER_WORKERS", 16)
+
+# Connections that can wait for a free worker before new ones are turned away
+SERVER_BACKLOG = getattr(config, "SERVER_BACKLOG", 64)
+
+# Seconds an idle keep-alive connection is kept open, and that a client
+# may take to send the rest of a request it has started
+SERVER_KEEPALIVE_TIMEOUT = getattr(config, "SERVER_KEEPALIVE_TIMEOUT", 5)
+
+# Largest unread request body that is skipped to keep a connection open
+MAX_DRAIN = 64 * 1024
+
+BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: 1\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+
+class RequestBody:
+    """
+    Request body stream that stops at the end of the body,
+    so the rest of the connection can carry the next request.
+    """
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.remaining = length
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        data = self.stream.read(self._limit(size))
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(self._limit(size))
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b""))
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def drain(self) -> bool:
+        """
+        Skip what the application didn't read. Returns False if there was too much.
+        """
+        if self.remaining > MAX_DRAIN:
+            return False
+        while self.remaining:
+            if not self.read(self.remaining):
+                return False
+        return True
+
+
+class KeepAliveServerHandler(ServerHandler):
+    http_version = "1.1"
+    # Whether the response's length was known, so the connection can be reused
+    delimited = False
+
+    def close(self):
+        # Without a length, the end of the response is marked by closing the connection
+        self.delimited = self.headers is not None and "Content-Length" in self.headers
+        super().close()
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Serves any number of HTTP/1.1 requests over one connection.
+    Once no request is waiting, the connection is left `idle`, for the
+    server to watch, instead of holding its worker until the next one.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = SERVER_KEEPALIVE_TIMEOUT
+    idle = False
+
+    def handle(self):
+        # Skips WSGIRequestHandler.handle, which serves only one request
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and not self.server.closing:
+            if not self.request_waiting():
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def request_waiting(self) -> bool:
+        """
+        Whether any of the next request has arrived, without waiting for it.
+        """
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except OSError:
+            # Idle for too long, or closed by the client
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            self.close_connection = True
+            return
+
+        if not self.parse_request():
+            return
+        if self.request_version != "HTTP/1.1" or "Transfer-Encoding" in self.headers:
+            self.close_connection = True
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.send_error(400, "Bad Content-Length")
+            self.close_connection = True
+            return
+        body = RequestBody(self.rfile, length)
+
+        handler = KeepAliveServerHandler(
+            body,
+            self.wfile,
+            self.get_stderr(),
+            self.get_environ(),
+            multithread=True,
+        )
+        handler.request_handler = self
+        try:
+            handler.run(self.server.get_app())
+        except OSError:
+            self.close_connection = True
+            return
+
+        if not handler.delimited or not body.drain():
+            self.close_connection = True
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    WSGI server that hands each connection to a fixed pool of worker threads.
+    When every worker is busy and the backlog is full, new connections get
+    a 503 response instead of waiting indefinitely.
+
+    Idle keep-alive connections don't hold a worker. One thread watches them
+    all, and hands each back to the workers when its next request arrives.
+    """
+
+    request_queue_size = SERVER_BACKLOG
+
+    def __init__(
+        self,
+        *a,
+        workers=SERVER_WORKERS,
+        backlog=SERVER_BACKLOG,
+        keepalive_timeout=SERVER_KEEPALIVE_TIMEOUT,
+        **ka,
+    ):
+        # Set before binding, as a failure to bind calls server_close()
+        self.closing = False
+        self.requests: Queue = Queue(backlog)
+        self.workers = []
+        self.watcher = None
+        super().__init__(*a, **ka)
+        self.keepalive_timeout = keepalive_timeout
+        # Connections left idle by workers, for the watcher to pick up
+        self.idle: deque = deque()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_writer.setblocking(False)
+        self.workers = [
+            threading.Thread(target=self.work, name=f"wsgi-worker-{_}", daemon=True)
+            for _ in range(workers)
+        ]
+        self.watcher = threading.Thread(
+            target=self.watch_idle, name="wsgi-idle", daemon=True
+        )
+        for worker in self.workers + [self.watcher]:
+            worker.start()
+
+    def work(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            request, client_address = request
+            handler = None
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            if handler is not None and handler.idle and not self.closing:
+                self.idle.append((request, client_address))
+                self.wake()
+            else:
+                self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b"\0")
+        except OSError:
+            # Already due to wake up
+            pass
+
+    def watch_idle(self):
+        """
+        Wait for the next request on idle connections, and queue each
+        connection for the workers again when one arrives. Connections idle
+        for longer than the keep-alive timeout are closed.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.wake_reader, selectors.EVENT_READ)
+        watched = {}
+        while not self.closing:
+            while self.idle:
+                request, client_address = self.idle.popleft()
+                deadline = time.monotonic() + self.keepalive_timeout
+                watched[request] = client_address, deadline
+                selector.register(request, selectors.EVENT_READ)
+
+            now = time.monotonic()
+            for request, (_, deadline) in list(watched.items()):
+                if deadline <= now:
+                    selector.unregister(request)
+                    del watched[request]
+                    self.shutdown_request(request)
+            deadlines = [deadline for _, deadline in watched.values()]
+            timeout = min(deadlines) - now if deadlines else None
+
+            for key, _ in selector.select(timeout):
+                if key.fileobj is self.wake_reader:
+                    self.wake_reader.recv(4096)
+                    continue
+                selector.unregister(key.fileobj)
+                client_address, _ = watched.pop(key.fileobj)
+                self.process_request(key.fileobj, client_address)
+
+        for request in list(watched) + [_[0] for _ in self.idle]:
+            self.shutdown_request(request)
+        selector.close()
+
+    def process_request(self, request, client_address):
+        try:
+            self.requests.put_nowait((request, client_address))
+        except Full:
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.closing = True
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+        if self.watcher is not None:
+            self.wake()
+            self.watcher.join()
+            self.wake_reader.close()
+            self.wake_writer.close()
+
+
+def make_server(host, port, app):
+    """
+    Create the server for `app`, of the kind set by SERVER_MODE.
+    """
+    if SERVER_MODE == "threaded":
+        return make_wsgi_server(host, port, app, ThreadingWSGIServer)
+    return make_wsgi_server(host, port, app, PooledWSGIServer, KeepAliveRequestHandler)
@@ -54,6 +54,973 @@ class TestRendering(unittest.TestCase):
             output,
         )
 
+    def test_render_cache(self):
+        article = self._make_article("Render cache article")
+        article.content = "Link to [[Render cache target]]"
+        article.save()
+
+        first = article.formatted
+        key, dependencies, html = article.rendered_content.split("\n", 2)
+        self.assertEqual(key, article.render_key)
+        self.assertEqual(html, first)
+
+        reloaded = self.models.Article.get_by_id(article.id)
+        self.assertEqual(reloaded.rendered_content, article.rendered_content)
+        self.assertEqual(reloaded.formatted, first)
+
+        # Changes to other articles it doesn't depend on leave it persisted
+        unrelated = self._make_article("Render cache unrelated")
+        unrelated.add_tag("Render cache tag")
+        unrelated.set_metadata("key", "value")
+        reloaded = self.models.Article.get_by_id(article.id)
+        self.assertEqual(reloaded.rendered_content, article.rendered_content)
+        self.assertEqual(reloaded.render_key, key)
+
+        # Creating the link target changes how the link renders
+        self._make_article("Render cache target")
+        reloaded = self.models.Article.get_by_id(article.id)
+        self.assertIsNone(reloaded.rendered_content)
+        self.assertNotIn("wiki-missing-link", reloaded.formatted)
+
+        self.assertEqual(self.wiki.rebuild_render_cache(), self.wiki.articles.count())
+
+    def test_render_dependencies(self):
+        cache = self.models.Wiki.article_cache
+        linking = self._make_article("Linking article")
+        linking.content = "[[Dependency target]]"
+        linking.save()
+        unrelated = self._make_article("Unrelated article")
+        unrelated.content = "No links here."
+        unrelated.save()
+
+        linking.formatted
+        unrelated.formatted
+        self.assertIn(("body", linking.id), cache)
+        self.assertIn(("body", unrelated.id), cache)
+
+        # A page depends on what its text did, even if the text is since evicted
+        cache.discard(("body", linking.id))
+        self.assertIn(
+            self.wiki.dependency("title", "Dependency target"),
+            linking.page_dependencies,
+        )
+        linking.formatted
+
+        # Only the article linking to the new one is evicted
+        self._make_article("Dependency target")
+        self.assertNotIn(("body", linking.id), cache)
+        self.assertIn(("body", unrelated.id), cache)
+
+        # Invalidating another wiki leaves this wiki's renders alone
+        self.models.System.invalidate_cache()
+        self.assertIn(("body", unrelated.id), cache)
+
+        unrelated.content = "Changed."
+        unrelated.save()
+        self.assertNotIn(("body", unrelated.id), cache)
+
+    def test_store_render_invalidated(self):
+        Article, RenderDependency = self.models.Article, self.models.RenderDependency
+        cache = self.models.Wiki.article_cache
+        article = self._make_article("Invalidated while saving")
+        article.content = "Saved text"
+        article.save()
+
+        # An invalidation that lands between the check and the write
+        record = RenderDependency.__dict__["record"]
+
+        @classmethod
+        def invalidating_record(cls, article_id, dependencies):
+            article.dependency_changed()
+            record.__func__(cls, article_id, dependencies)
+
+        stamp = cache.stamp(self.wiki.id)
+        html = article._formatted(article.content)
+        RenderDependency.record = invalidating_record
+        try:
+            article.store_render(html, article.render_dependencies, stamp)
+        finally:
+            RenderDependency.record = record
+        self.assertIsNone(Article.get_by_id(article.id).rendered_content)
+        self.assertNotIn(("body", article.id), cache)
+
+    def test_link_resolver(self):
+        target = self._make_article("Resolver target")
+        target.add_tag("Resolver tag")
+
+        resolver = self.models.LinkResolver(self.wiki)
+        resolver.add("title", "Resolver target")
+        resolver.add("title", "Resolver missing")
+        resolver.add("tag", "Resolver tag")
+        resolver.resolve()
+        self.assertEqual(resolver.pending, {"title": set(), "tag": set()})
+
+        self.assertEqual(resolver.get("title", "Resolver target"), target.id)
+        self.assertEqual(resolver.exists("title", "Resolver missing"), False)
+        self.assertEqual(resolver.exists("tag", "Resolver tag"), True)
+        # Names not gathered beforehand are looked up on demand
+        self.assertEqual(resolver.exists("tag", "Resolver missing tag"), False)
+
+    def test_table_cells(self):
+        article = self._make_article("Table cell article")
+        # Cells rendered without the block parser match a full render
+        for cell in (
+            " plain text ",
+            "**bold** [[Table cell article]] ~~struck~~",
+            "[x] done",
+            "# heading",
+            "- item",
+            "    indented",
+            "[ref]: /url",
+            "",
+        ):
+            self.assertEqual(
+                article._formatted(cell, None, True), article._formatted(cell)
+            )
+
+    def test_adjacent_inline_tokens(self):
+        article = self._make_article("Adjacent tokens article")
+        root = self.wiki.article_root_link
+        # Each inline pass runs over the output of the ones before it,
+        # so tokens that touch or overlap are taken as they always have been
+        for content, inline, metadata in (
+            ("$[a]$$$[b]$$$[c]$", "c", [("@blurb", "b"), ("@blurb", "c")]),
+            ("$[a]$$[b]$", "b", [("@blurb", "b")]),
+            (
+                "[[Contents]][[Tags]](Linking)",
+                f"[Contents]({root}/Contents)[Tags]({root}/Linking)",
+                [],
+            ),
+            (
+                "[[Contents]](Linking) [[Tags]]",
+                f"[Contents]({root}/Linking) [Tags]({root}/Tags)",
+                [],
+            ),
+            (
+                "![[[Contents]]](x.jpg)",
+                f"![[Contents]({self.wiki.media_link}/{root}/%255BContents)](x.jpg)",
+                [],
+            ),
+            (
+                "~~[[Contents]]~~[x][ ]",
+                f"<strike>[Contents]({root}/Contents)</strike>"
+                '<input type="checkbox" disabled checked />'
+                '<input type="checkbox" disabled/>',
+                [],
+            ),
+            (
+                "$[{{Include article}}]$",
+                "\n\n**Formatted content.**",
+                [
+                    ("@blurb", "Include article with metadata."),
+                    ("@blurb", "\n\n**Formatted content.**"),
+                ],
+            ),
+        ):
+            article.render_context = self.models.RenderContext(article)
+            article.autogen_metadata = []
+            article.render_dependencies = set()
+            self.assertEqual(
+                article._content_regions(content, article._inline_format), inline
+            )
+            self.assertEqual(article.autogen_metadata, metadata)
+
+    def test_articles_macro(self):
+        cache = self.models.Wiki.article_cache
+        for title, order in (("Listed B", "1"), ("Listed A", "2")):
+            article = self._make_article(title)
+            article.add_tag("Listed")
+            article.set_metadata("order", order)
+        self.models.Article.get(self.models.Article.title == "Listed A").set_metadata(
+            "@blurb", "First"
+        )
+
+        index = self._make_article("Listed index")
+        html = index._formatted('<<articles tag="Listed" sort="order">>')
+        self.assertLess(html.index("Listed B"), html.index("Listed A"))
+        self.assertIn("Listed A</a> -- First", html)
+        cache_key = ("articles", self.wiki.id, "Listed", "order")
+        self.assertIn(cache_key, cache)
+
+        # Changing a listed article's metadata evicts the listing
+        self.models.Article.get(self.models.Article.title == "Listed B").set_metadata(
+            "order", "3"
+        )
+        self.assertNotIn(cache_key, cache)
+        html = index._formatted('<<articles tag="Listed" sort="order">>')
+        self.assertLess(html.index("Listed A"), html.index("Listed B"))
+
+    def test_nested_includes(self):
+        outer = self._make_article("Include outer")
+        inner = self._make_article("Include inner")
+        for article, content in (
+            (outer, "Outer {{Include inner}}"),
+            (inner, "inner {{Include outer}}"),
+        ):
+            article.content = content
+            article.save()
+
+        self.assertEqual(
+            outer._formatted(outer.content),
+            "<p>Outer inner <inline-error>[Circular include: Include outer]</inline-error></p>\n",
+        )
+        self.assertIn(("article", "Include inner"), outer.render_dependencies)
+
+        # Editing the included article discards the persisted render of its includer
+        outer.formatted
+        self.assertIsNotNone(self.models.Article.get_by_id(outer.id).rendered_content)
+        self.assertIn(
+            ("article", "Include inner"),
+            [(_.kind, _.name) for _ in outer.persisted_dependencies],
+        )
+        inner.content = "changed"
+        inner.save()
+        self.assertIsNone(self.models.Article.get_by_id(outer.id).rendered_content)
+
+    def test_render_pool(self):
+        import threading
+        import render_pool
+
+        articles = []
+        for n in range(4):
+            article = self._make_article(f"Pooled {n}")
+            article.content = f"[[Pooled {(n + 1) % 4}]] $[number:{n}]$"
+            article.save()
+            articles.append(article)
+
+        # Another thread holds the cache and database locks as the workers fork
+        locked, done = threading.Event(), threading.Event()
+
+        def hold_locks():
+            with self.models.Wiki.article_cache.lock, self.models.db._lock:
+                locked.set()
+                done.wait()
+
+        holder = threading.Thread(target=hold_locks)
+        holder.start()
+        locked.wait()
+        threshold = render_pool.RENDER_SERIAL_THRESHOLD
+        workers = render_pool.RENDER_WORKERS
+        render_pool.RENDER_SERIAL_THRESHOLD = 0
+        render_pool.RENDER_WORKERS = 2
+        try:
+            renders = render_pool.render_articles(articles)
+            # Pages are yielded as they are ready, until closed
+            with self.models.export_links():
+                pages = render_pool.render_pages(articles, self.author)
+                first_page = next(pages)
+                pages.close()
+        finally:
+            render_pool.RENDER_SERIAL_THRESHOLD = threshold
+            render_pool.RENDER_WORKERS = workers
+            done.set()
+            holder.join()
+
+        for article, (html, metadata, dependencies) in zip(articles, renders):
+            self.assertEqual(html, article._formatted(article.content))
+            self.assertEqual(metadata, article.autogen_metadata)
+            self.assertEqual(dependencies, sorted(article.render_dependencies))
+        self.assertIn("<title>Pooled 0", first_page)
+
+    def test_render_profile(self):
+        RenderProfile = self.models.RenderProfile
+        included = self._make_article("Profiled include")
+        included.content = "included"
+        included.save()
+        article = self._make_article("Profiled article")
+        article.content = "{{Profiled include}} [[Contents]]\n\n|a|[[b]]|\n"
+        article.save()
+
+        RenderProfile.enabled = True
+        try:
+            article._formatted(article.content)
+        finally:
+            RenderProfile.enabled = False
+
+        profile = article.render_profile
+        self.assertIn(profile, RenderProfile.slowest(self.wiki))
+        self.assertEqual(profile.stages["includes"][1], 1)
+        self.assertIn("tables", profile.stages)
+        self.assertEqual(
+            profile.query_total, sum(queries for _, queries in profile.stages.values())
+        )
+        self.assertIn("commonmark;dur=", profile.server_timing())
+
+    def test_render_budget(self):
+        RenderContext = self.models.RenderContext
+        article = self._make_article("Budgeted article")
+        article.content = "[[Contents]] " * 10
+        article.save()
+        article.update_links()
+        links = article.ext_links.count()
+        rendered_content = article.rendered_content
+
+        size_limit = RenderContext.size_limit
+        RenderContext.size_limit = 100
+        try:
+            html = article.rerender()
+        finally:
+            RenderContext.size_limit = size_limit
+        self.assertIn("too long to render", html)
+        self.assertIsNone(article.render_dependencies)
+        self.assertEqual(
+            self.models.Article.get_by_id(article.id).rendered_content,
+            rendered_content,
+        )
+
+        # A render stopped short leaves the links of the last complete one
+        article.update_links(html)
+        self.assertEqual(article.ext_links.count(), links)
+
+        time_limit = RenderContext.time_limit
+        RenderContext.time_limit = 0
+        try:
+            html = article._formatted(article.content)
+        finally:
+            RenderContext.time_limit = time_limit
+        self.assertIn("longer than 0 seconds", html)
+
+        # Only long text is matched with a timeout
+        render_context = RenderContext(article)
+        short = "[[" * (RenderContext.timeout_min_length // 2 - 1)
+        self.assertEqual(render_context.regex_budget(short), {})
+        if self.models.REGEX_TIMEOUTS:
+            self.assertIn("timeout", render_context.regex_budget(short + "[["))
+
+    def test_render_cache_threads(self):
+        import threading
+        from cache import RenderCache
+
+        cache = RenderCache()
+        renders = []
+        started = threading.Event()
+
+        def render():
+            renders.append(1)
+            started.wait()
+            cache.set("key", "value", [(1, "id", 1)])
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(cache.get_or_render("key", render))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        started.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(renders), 1)
+
+        # A render begun before an invalidation is not stored
+        stamp = cache.stamp(1)
+        cache.invalidate((1, "id", 1))
+        self.assertFalse(cache.set("key", "stale", [(1, "id", 1)], stamp))
+        self.assertNotIn("key", cache)
+        self.assertTrue(cache.set("key", "fresh", [(1, "id", 1)], cache.stamp(1)))
+        # Other scopes are unaffected
+        stamp = cache.stamp(2)
+        cache.invalidate((1, "id", 1))
+        self.assertTrue(cache.is_current(stamp))
+
+    def test_render_cache_size(self):
+        from cache import RenderCache, size_of
+
+        page = "x" * 1000
+        cache = RenderCache(max_size=size_of(page) * 3)
+        for n in range(3):
+            cache.set(n, page, [(1, "id", n)])
+        cache.get(0)
+        cache.set(3, page, [(1, "id", 3)])
+
+        # The least recently used entry is evicted, along with its dependencies
+        self.assertNotIn(1, cache)
+        self.assertIn(0, cache)
+        self.assertNotIn((1, "id", 1), cache.dependents)
+        self.assertEqual(cache.size, size_of(page) * 3)
+        self.assertFalse(cache.set(4, page * 4))
+        self.assertEqual((cache.hits, cache.evictions), (1, 1))
+
+    def test_fragment_cache(self):
+        from routes.decorators import fragment
+
+        calls = []
+
+        def render():
+            calls.append(1)
+            return f"rendered {len(calls)}"
+
+        for _ in range(2):
+            self.assertEqual(
+                fragment(self.wiki, "test", render, [("tag", "Fragment")]),
+                "rendered 1",
+            )
+        self.wiki.invalidate_renders(("tag", "Other"))
+        self.assertEqual(fragment(self.wiki, "test", render), "rendered 1")
+        self.wiki.invalidate_renders(("tag", "Fragment"))
+        self.assertEqual(fragment(self.wiki, "test", render), "rendered 2")
+
+    def test_sidebar_lists(self):
+        import bottle
+        from routes import wiki as wiki_routes
+
+        self._use_templates()
+
+        # Other tests leave wikis with the same title behind
+        self.wiki.title = "Sidebar test wiki"
+        self.wiki.save()
+        for index in range(3):
+            self._make_article(f"Sidebar article {index}")
+        wiki_url = self.wiki.title_to_url(self.wiki.title)
+
+        page_size = wiki_routes.SIDEBAR_PAGE_SIZE
+        wiki_routes.SIDEBAR_PAGE_SIZE = 3
+        try:
+            bottle.request.bind({"QUERY_STRING": ""})
+            first = wiki_routes.sidebar_list(wiki_url, "articles")
+            self.assertEqual(first.count("<li>"), 3)
+            self.assertIn(f"{self.wiki.sidebar_link}/articles?p=2", first)
+
+            bottle.request.bind({"QUERY_STRING": "p=2"})
+            second = wiki_routes.sidebar_list(wiki_url, "articles")
+            self.assertEqual(second.count("<li>"), 2)
+            self.assertIn("Test data article", second)
+            self.assertNotIn("sidebar-more", second)
+
+            # A new article changes the lists, so they are rendered again
+            self._make_article("Sidebar article 3")
+            self.wiki.invalidate_cache()
+            self.assertEqual(
+                wiki_routes.sidebar_list(wiki_url, "articles").count("<li>"), 3
+            )
+            self.assertIn(
+                "Sidebar article 3", wiki_routes.sidebar_list(wiki_url, "articles")
+            )
+        finally:
+            wiki_routes.SIDEBAR_PAGE_SIZE = page_size
+
+    def test_article_column(self):
+        import bottle
+        from routes.decorators import article_display
+
+        self._use_templates()
+        article = self._make_article("Column article")
+
+        bottle.request.bind({"QUERY_STRING": ""})
+        page = article_display(self.wiki, self.author, article)
+        bottle.request.bind({"QUERY_STRING": "", "HTTP_X_FRAGMENT": "article"})
+        column = article_display(self.wiki, self.author, article)
+        bottle.request.bind({"QUERY_STRING": "fragment=article"})
+        self.assertEqual(article_display(self.wiki, self.author, article), column)
+
+        self.assertIn('id="sidebar"', page)
+        self.assertNotIn('id="sidebar"', column)
+        self.assertTrue(
+            column.startswith("<title>Column article (New test wiki)</title>")
+        )
+        start = page.index('    <div id="article-col"')
+        self.assertIn(column.split("\n", 1)[1], page[start:])
+
+    def test_article_etag(self):
+        import bottle
+        from routes.decorators import article_display
+
+        self._use_templates()
+        article = self._make_article("Etag article")
+
+        def display(**headers):
+            bottle.request.bind({"QUERY_STRING": "", **headers})
+            bottle.response.bind()
+            page = article_display(self.wiki, self.author, article)
+            return bottle.response.status_code, bottle.response.get_header("ETag"), page
+
+        status, etag, page = display()
+        self.assertEqual(status, 200)
+        self.assertIn("Etag article", page)
+        self.assertEqual(display(HTTP_IF_NONE_MATCH=etag), (304, etag, ""))
+        self.assertEqual(display(HTTP_IF_NONE_MATCH=f'"other", W/{etag}')[0], 304)
+
+        article.content = "Edited"
+        article.save()
+        status, new_etag, page = display(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status, 200)
+        self.assertNotEqual(new_etag, etag)
+        self.assertIn("Edited", page)
+
+    def test_pooled_server(self):
+        import http.client
+        import threading
+        import time
+        from wsgiref.simple_server import make_server
+        import wsgi_server
+
+        def app(environ, start_response):
+            time.sleep(0.2)
+            body = environ["wsgi.input"].read()
+            start_response("200 OK", [("Content-Length", str(len(body)))])
+            return [body]
+
+        server = make_server(
+            "127.0.0.1",
+            0,
+            app,
+            lambda *a, **ka: wsgi_server.PooledWSGIServer(
+                *a, workers=1, backlog=1, **ka
+            ),
+            wsgi_server.KeepAliveRequestHandler,
+        )
+        threading.Thread(target=server.serve_forever).start()
+        try:
+            # One connection carries several requests
+            connection = http.client.HTTPConnection(*server.server_address)
+            for body in ("first", "second"):
+                connection.request("POST", "/", body)
+                self.assertEqual(connection.getresponse().read(), body.encode())
+            connection.close()
+
+            # With the worker busy and the backlog full, the rest are turned away
+            statuses = []
+
+            def get():
+                connection = http.client.HTTPConnection(*server.server_address)
+                connection.request("GET", "/")
+                statuses.append(connection.getresponse().status)
+                connection.close()
+
+            threads = [threading.Thread(target=get) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(set(statuses), {200, 503})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # Idle keep-alive connections don't hold on to the workers
+        def echo(environ, start_response):
+            body = environ["wsgi.input"].read()
+            start_response("200 OK", [("Content-Length", str(len(body)))])
+            return [body]
+
+        server = make_server(
+            "127.0.0.1",
+            0,
+            echo,
+            lambda *a, **ka: wsgi_server.PooledWSGIServer(
+                *a, workers=16, keepalive_timeout=30, **ka
+            ),
+            wsgi_server.KeepAliveRequestHandler,
+        )
+        threading.Thread(target=server.serve_forever).start()
+        idle = []
+        try:
+            for _ in range(16):
+                connection = http.client.HTTPConnection(*server.server_address)
+                connection.request("POST", "/", "idle")
+                self.assertEqual(connection.getresponse().read(), b"idle")
+                idle.append(connection)
+
+            start = time.monotonic()
+            connection = http.client.HTTPConnection(*server.server_address)
+            connection.request("POST", "/", "another")
+            self.assertEqual(connection.getresponse().read(), b"another")
+            self.assertLess(time.monotonic() - start, 2)
+            connection.close()
+
+            # The idle connections are still open for more requests
+            idle[0].request("POST", "/", "again")
+            self.assertEqual(idle[0].getresponse().read(), b"again")
+        finally:
+            for connection in idle:
+                connection.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_read_transaction(self):
+        import threading
+
+        db = self.models.db
+        Article = self.models.Article
+        count = lambda: self.wiki.articles.count()
+
+        db.begin_request(read_only=True)
+        try:
+            before = count()
+            # Another thread, with its own connection, adds an article
+            thread = threading.Thread(
+                target=self._make_article, args=("Read transaction 1",)
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual(count(), before)
+
+            # Writing ends the read transaction
+            self._make_article("Read transaction 2")
+            self.assertEqual(count(), before + 2)
+
+            # A transaction inside the request is still atomic
+            with self.assertRaises(ValueError):
+                with db.transaction():
+                    self._make_article("Read transaction 3")
+                    raise ValueError
+            self.assertEqual(count(), before + 2)
+        finally:
+            db.end_request()
+        self.assertFalse(db.in_transaction())
+        self.assertFalse(db.connection().in_transaction)
+
+        db.begin_request(read_only=True)
+        with db.atomic():
+            self._make_article("Read transaction 4")
+        db.end_request()
+        self.assertEqual(
+            Article.select().where(Article.title == "Read transaction 4").count(), 1
+        )
+
+    def test_read_transaction_render(self):
+        import threading
+
+        db = self.models.db
+        Article = self.models.Article
+        article = self._make_article("Read transaction render")
+        article.content = "old text"
+        article.save()
+
+        def edit():
+            article = Article.get_by_id(article_id)
+            article.content = "new text"
+            article.save()
+
+        article_id = article.id
+        db.begin_request(read_only=True)
+        try:
+            article = Article.get_by_id(article_id)
+            # Edited after the request's snapshot, before anything is stamped
+            thread = threading.Thread(target=edit)
+            thread.start()
+            thread.join()
+            self.assertEqual(article.formatted, "<p>old text</p>\n")
+        finally:
+            db.end_request()
+        self.assertEqual(Article.get_by_id(article_id).formatted, "<p>new text</p>\n")
+
+    def test_identity_map(self):
+        db = self.models.db
+        Article, Wiki = self.models.Article, self.models.Wiki
+        self.wiki.title = "Identity map wiki"
+        self.wiki.save()
+        self._make_article("Identity map 1")
+        self._make_article("Identity map 2")
+        titles = ("Identity map 1", "Identity map 2")
+
+        db.begin_request(read_only=True)
+        try:
+            wiki = Wiki.get_by_title("Identity map wiki")
+            first, second = wiki.articles.where(Article.title.in_(titles))
+            before = db.query_count
+            self.assertIs(first.wiki, wiki)
+            self.assertIs(second.author, first.author)
+            self.assertIs(Wiki.get_by_title("Identity map wiki"), wiki)
+            self.assertEqual(db.query_count, before + 1)
+        finally:
+            db.end_request()
+        self.assertIsNone(db.identities)
+
+        # Renaming forgets the old title
+        self.wiki.title = "Identity map wiki renamed"
+        self.wiki.save()
+        with self.assertRaises(Wiki.DoesNotExist):
+            Wiki.get_by_title("Identity map wiki")
+        self.assertEqual(
+            Wiki.get_by_title("Identity map wiki renamed").id, self.wiki.id
+        )
+
+    def test_prefetch_metadata(self):
+        db = self.models.db
+        Article = self.models.Article
+        articles = []
+        for n in range(3):
+            article = self._make_article(f"Prefetched {n}")
+            article.set_metadata("colour", f"red {n}")
+            articles.append(Article.get_by_id(article.id))
+
+        Article.prefetch_metadata(articles, ("colour", "size"))
+        before = db.query_count
+        self.assertEqual(
+            [_.get_metadata("colour") for _ in articles], ["red 0", "red 1", "red 2"]
+        )
+        self.assertEqual(articles[0].get_metadata("size", "none"), "none")
+        self.assertEqual(db.query_count, before + 1)
+
+        # Keys not prefetched, and changed metadata, are queried as usual
+        self.assertIsNone(articles[0].get_metadata("weight"))
+        articles[1].set_metadata("colour", "blue")
+        self.assertEqual(articles[1].get_metadata("colour"), "blue")
+
+    def test_migrations(self):
+        import json
+        import migrations
+        from settings import DB_SCHEMA
+
+        db, System = self.models.db, self.models.System
+        index = "article_wiki_id_title"
+        indexes = lambda: [_.name for _ in db.get_indexes("article")]
+
+        # New databases start at the current schema
+        self.assertEqual(migrations.schema_version(), DB_SCHEMA)
+        self.assertEqual(migrations.run(report=lambda _: None), [])
+
+        # A failed migration is rolled back, and leaves the version alone
+        System.set_metadata("schema", 1)
+        try:
+            with self.assertRaises(Exception):
+                migrations.run(report=lambda _: None)
+            self.assertEqual(migrations.schema_version(), 1)
+
+            for name in (
+                index,
+                "metadata_item_item_id_key",
+                "tag_wiki_id_title",
+                "media_wiki_id_file_path",
+            ):
+                db.execute_sql(f'DROP INDEX "{name}"')
+            self.assertNotIn(index, indexes())
+            RenderDependency = self.models.RenderDependency
+            self.article.formatted
+            RenderDependency.drop_table()
+            applied = migrations.run(report=lambda _: None)
+            self.assertEqual([_[0] for _ in applied], [2, 3])
+            self.assertIn(index, indexes())
+            # Dependencies of renders persisted before are filled in
+            self.assertEqual(
+                RenderDependency.select()
+                .where(RenderDependency.article == self.article.id)
+                .count(),
+                len(json.loads(self.article.rendered_content.split("\n", 2)[1])),
+            )
+        finally:
+            System.set_metadata("schema", DB_SCHEMA)
+
+        System.set_metadata("schema", DB_SCHEMA + 1)
+        try:
+            with self.assertRaises(migrations.MigrationError):
+                migrations.run()
+        finally:
+            System.set_metadata("schema", DB_SCHEMA)
+
+        # Migrations without a docstring are reported by name
+        def undocumented_migration(migrator):
+            pass
+
+        latest = migrations.migrations[DB_SCHEMA]
+        migrations.migrations[DB_SCHEMA] = undocumented_migration
+        System.set_metadata("schema", DB_SCHEMA - 1)
+        try:
+            reports = []
+            migrations.run(report=reports.append)
+            self.assertIn("(undocumented_migration)", reports[0])
+        finally:
+            migrations.migrations[DB_SCHEMA] = latest
+            System.set_metadata("schema", DB_SCHEMA)
+
+    def test_export_links(self):
+        import threading
+
+        article = self._make_article("Export links article")
+        article.content = "Link to [[Test data article]]"
+        article.save()
+        live_link, live_html = article.link, article.formatted
+
+        other_thread = []
+        with self.models.export_links():
+            self.assertTrue(article.link.endswith(".html"))
+            self.assertIn(".html", article.formatted)
+            # Other requests go on linking as usual
+            thread = threading.Thread(
+                target=lambda: other_thread.append((article.link, article.formatted))
+            )
+            thread.start()
+            thread.join()
+        self.assertEqual(other_thread, [(live_link, live_html)])
+        self.assertEqual(article.formatted, live_html)
+
+    def test_jobs(self):
+        import jobs
+
+        Job = self.models.Job
+        seen = []
+
+        @jobs.handler("test")
+        def visit_articles(job, wiki, cancel_at=None):
+            articles = list(wiki.articles)
+            job.total = len(articles)
+            for article in articles:
+                if job.done == cancel_at:
+                    jobs.cancel(job.id)
+                job.check()
+                # Progress is seen as the worker records it
+                seen.append(jobs.get(job.id).done)
+                job.advance()
+
+        job = Job.create(kind="test", title="Test job", wiki_id=self.wiki.id)
+        jobs.run(job)
+        job = Job.get_by_id(job.id)
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.done, self.wiki.articles.count())
+        self.assertEqual(seen, list(range(job.done)))
+
+        job = Job.create(
+            kind="test",
+            title="Test job",
+            wiki_id=self.wiki.id,
+            arguments='{"cancel_at": 1}',
+        )
+        jobs.run(job)
+        job = Job.get_by_id(job.id)
+        self.assertEqual((job.status, job.done), (Job.CANCELLED, 1))
+        self.assertEqual(job.message, "Cancelled.")
+
+        # A queued job is cancelled without running
+        job = Job.create(kind="test", title="Test job", wiki_id=self.wiki.id)
+        jobs.cancel(job.id)
+        jobs.run(job)
+        self.assertEqual(Job.get_by_id(job.id).status, Job.CANCELLED)
+        self.assertEqual(job.done, 0)
+
+        # Cancelling a wiki's deletion leaves it as it was
+        wiki = self.models.Wiki.new_wiki("Job test wiki", "", self.author)
+        job = Job(cancel_requested=True)
+        with self.assertRaises(Job.Cancelled):
+            wiki.delete_(job)
+        self.assertEqual(self.models.Wiki.get_by_id(wiki.id).articles.count(), 1)
+        wiki.delete_()
+
+        # A replace-all stopped partway says how much it had already changed
+        from routes import wiki as wiki_routes
+
+        for title in ("Replace job A", "Replace job B"):
+            article = self._make_article(title)
+            article.content = "Replace job text"
+            article.save()
+        job = Job.create(kind="replace", title="Test job", wiki_id=self.wiki.id)
+        advance = job.advance
+
+        def advance_and_cancel(count=1):
+            advance(count)
+            job.cancel_requested = True
+
+        job.advance = advance_and_cancel
+        with self.assertRaisesRegex(Job.Cancelled, "after 1 of 2 articles"):
+            wiki_routes.wiki_replace_job(
+                job, self.wiki, "Replace job text", "Replaced job text"
+            )
+        self.assertEqual(
+            self.wiki.articles.where(
+                self.models.Article.content == "Replaced job text"
+            ).count(),
+            1,
+        )
+
+    def test_static_assets(self):
+        import gzip, tempfile
+        from assets import StaticAssets
+
+        with tempfile.TemporaryDirectory() as root:
+            static_path, cache_path = Path(root, "static"), Path(root, "cache")
+            static_path.mkdir()
+            Path(static_path, "site.css").write_text("body { color: red; }\n" * 100)
+            Path(static_path, "cover.jpg").write_bytes(b"\xff\xd8" * 100)
+
+            assets = StaticAssets(static_path, cache_path)
+            first = assets.fingerprint
+            self.assertEqual(assets.precompress(), 1)
+            self.assertEqual(
+                gzip.decompress(assets.compressed("site.css").read_bytes()),
+                Path(static_path, "site.css").read_bytes(),
+            )
+            self.assertIsNone(assets.compressed("cover.jpg"))
+            self.assertIsNone(assets.compressed("../site.css"))
+
+            # Changed files get a new fingerprint, and the old copies are removed
+            Path(static_path, "site.css").write_text("body { color: blue; }\n" * 100)
+            assets = StaticAssets(static_path, cache_path)
+            self.assertNotEqual(assets.fingerprint, first)
+            assets.precompress()
+            self.assertEqual(
+                [_.name for _ in cache_path.iterdir()], [assets.fingerprint]
+            )
+
+        self.assertEqual(
+            self.wiki.static_folder_link,
+            f"/static/{self.models.Wiki.static_assets.fingerprint}",
+        )
+        with self.models.export_links():
+            self.assertEqual(self.wiki.static_folder_link, "../static")
+
+    def test_gzip_middleware(self):
+        import gzip
+        from compression import GzipMiddleware, accepts_gzip
+
+        page = b"<p>Hello, world</p>" * 100
+
+        def app(environ, start_response):
+            body = page if environ["PATH_INFO"] == "/page" else b"<p>Hi</p>"
+            start_response(
+                "200 OK",
+                [
+                    ("Content-Type", "text/html; charset=UTF-8"),
+                    ("Content-Length", str(len(body))),
+                    ("ETag", '"abc"'),
+                    ("Vary", "X-Fragment"),
+                ],
+            )
+            return [body]
+
+        def call(path, accept="gzip, deflate"):
+            started = {}
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": path,
+                "HTTP_ACCEPT_ENCODING": accept,
+            }
+            body = b"".join(middleware(environ, lambda s, h, e=None: started.update(h)))
+            return started, body
+
+        middleware = GzipMiddleware(app, minimum_size=1024)
+        headers, body = call("/page")
+        self.assertEqual(gzip.decompress(body), page)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Content-Length"], str(len(body)))
+        self.assertEqual(headers["Vary"], "X-Fragment, Accept-Encoding")
+        self.assertEqual(headers["ETag"], 'W/"abc"')
+
+        # The same response again comes from the cache
+        self.assertEqual(call("/page")[1], body)
+        self.assertEqual(middleware.cache.hits, 1)
+
+        # Too small to bother with, or not accepted
+        self.assertEqual(call("/small")[1], b"<p>Hi</p>")
+        self.assertEqual(call("/page", "identity")[1], page)
+        self.assertEqual(call("/page", "gzip;q=0")[1], page)
+        headers = call("/page", "br")[0]
+        self.assertNotIn("Content-Encoding", headers)
+        # Caches still need to know that other clients may get it compressed
+        self.assertEqual(headers["Vary"], "X-Fragment, Accept-Encoding")
+        self.assertEqual(call("/small")[0]["Vary"], "X-Fragment, Accept-Encoding")
+        self.assertTrue(accepts_gzip({"HTTP_ACCEPT_ENCODING": "br, *;q=0.5"}))
+
+    def _use_templates(self):
+        import bottle
+
+        templates = str(Path("folio", "templates").absolute())
+        if templates not in bottle.TEMPLATE_PATH:
+            bottle.TEMPLATE_PATH.insert(0, templates)
+
     def _make_article(self, article_title):
         article = self.models.Article(
             wiki=self.wiki,